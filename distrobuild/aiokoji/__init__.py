@@ -0,0 +1,90 @@
+#  Copyright (c) 2021 The Distrobuild Authors
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+import asyncio
+import math
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Union
+
+import koji
+from koji_cli.lib import activate_session
+
+
+# Runs Koji XML-RPC calls on a bounded thread pool so hub latency doesn't block the event loop.
+# koji.ClientSession isn't thread safe, so every pool thread keeps its own authenticated session.
+class AsyncKojiSession:
+    def __init__(self, config: dict, pool_size: int, multicall_batch: int):
+        self.config = config
+        self.multicall_batch = multicall_batch
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="koji")
+        self._local = threading.local()
+
+    def _session(self) -> koji.ClientSession:
+        session = getattr(self._local, "session", None)
+        if not session:
+            session = koji.ClientSession(self.config["server"], self.config)
+            activate_session(session, self.config)
+            self._local.session = session
+
+        return session
+
+    def _call(self, method: str, args: tuple, kwargs: dict):
+        return getattr(self._session(), method)(*args, **kwargs)
+
+    def _multicall(self, method: str, calls: List[Union[tuple, dict]], kwargs: dict) -> list:
+        virtual_calls = []
+        with self._session().multicall(strict=True, batch=self.multicall_batch) as m:
+            for call in calls:
+                if isinstance(call, dict):
+                    virtual_calls.append(getattr(m, method)(**call, **kwargs))
+                else:
+                    virtual_calls.append(getattr(m, method)(*call, **kwargs))
+
+        return [virtual_call.result for virtual_call in virtual_calls]
+
+    async def call(self, method: str, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, self._call, method, args, kwargs)
+
+    # Calls `method` once for every entry in calls (a tuple of positional or a dict of keyword arguments),
+    # using as few round trips as the multicall batch size allows. Results keep the order of calls.
+    async def multicall(self, method: str, calls: List[Union[tuple, dict]], **kwargs) -> list:
+        if len(calls) == 0:
+            return []
+
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, self._multicall, method, calls, kwargs)
+
+    def multicall_round_trips(self, calls: int) -> int:
+        return math.ceil(calls / self.multicall_batch)
+
+    def __getattr__(self, method: str):
+        if method.startswith("_"):
+            raise AttributeError(method)
+
+        async def wrapper(*args, **kwargs):
+            return await self.call(method, *args, **kwargs)
+
+        return wrapper
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -37,7 +37,7 @@ from distrobuild.routes import register_routes
 # init sessions
 from distrobuild import session
 
-from distrobuild_scheduler import init_channel
+from distrobuild_scheduler import init_channel, init_redis, close_redis
 
 app = FastAPI()
 app.add_middleware(RedisSessionMiddleware, secret_key=settings.session_secret, max_age=3000, fapi=app,
@@ -73,6 +73,15 @@ async def serve_frontend(request: Request):
 @app.on_event("startup")
 async def startup():
     await init_channel(asyncio.get_event_loop())
+    await init_redis()
+    await session.mbs_client.open()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    session.koji_session.close()
+    await session.mbs_client.close()
+    await close_redis()
 
 
 register_tortoise(
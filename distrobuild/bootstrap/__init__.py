@@ -48,7 +48,7 @@ async def process_repo_dump(repo: Repo, responsible_username: str) -> None:
 
             is_package = True
             if repo == Repo.MODULAR_CANDIDATE:
-                koji_session.packageListAdd(tags.modular_updates_candidate(), package_name, "distrobuild")
+                await koji_session.packageListAdd(tags.modular_updates_candidate(), package_name, "distrobuild")
                 is_package = False
 
             await _internal_create_package(name=package_name,
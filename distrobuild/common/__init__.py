@@ -21,8 +21,9 @@
 from typing import List, Tuple, Optional
 
 from fastapi import Request, HTTPException
+from tortoise.query_utils import Q
 
-from distrobuild.models import Import, ImportStatus, Package, PackageModule, BatchImportPackage, Repo
+from distrobuild.models import Import, ImportCommit, ImportStatus, Package, PackageModule, BatchImportPackage, Repo
 from distrobuild.settings import settings
 
 
@@ -39,16 +40,31 @@ def gen_body_filters(body: dict) -> dict:
     return filters
 
 
-async def create_import_order(package: Package, username: str, batch_import_id: Optional[int] = None) -> \
-        List[Tuple[int, int]]:
-    pkg_list = []
+# Creates the imports for package as a dependency graph. A module import points its components
+# (the package's own rpm import and any subpackages that were never imported) at itself through
+# parent_import_id and only becomes ready once all of them finished.
+# Returns (package id, import id, module) of the imports that can start right away.
+async def create_import_order(package: Package, username: str, batch_import_id: Optional[int] = None,
+                              parent_import_id: Optional[int] = None) -> List[Tuple[int, int, bool]]:
+    ready = []
+
+    package_module_import = None
+    if package.is_module:
+        package_module_import = await Import.create(package_id=package.id, status=ImportStatus.QUEUED,
+                                                    module=True, executor_username=username,
+                                                    version=settings.version, parent_import_id=parent_import_id)
+        if batch_import_id:
+            await BatchImportPackage.create(import_id=package_module_import.id, batch_import_id=batch_import_id)
+
+    component_parent_id = package_module_import.id if package_module_import else parent_import_id
 
     if package.is_package:
         package_import = await Import.create(package_id=package.id, status=ImportStatus.QUEUED,
-                                             executor_username=username, version=settings.version)
+                                             executor_username=username, version=settings.version,
+                                             parent_import_id=component_parent_id)
         if batch_import_id:
             await BatchImportPackage.create(import_id=package_import.id, batch_import_id=batch_import_id)
-        pkg_list.append((package.id, package_import.id))
+        ready.append((package.id, package_import.id, False))
 
     if package.is_module:
         subpackages = await PackageModule.filter(module_parent_package_id=package.id).all()
@@ -56,41 +72,98 @@ async def create_import_order(package: Package, username: str, batch_import_id:
             imports = await Import.filter(package_id=subpackage.package_id).all()
             if not imports or len(imports) == 0:
                 subpackage_package = await Package.filter(id=subpackage.package_id).get()
-                pkg_list += await create_import_order(subpackage_package, username, batch_import_id)
+                ready += await create_import_order(subpackage_package, username, batch_import_id,
+                                                   package_module_import.id)
 
-        package_module_import = await Import.create(package_id=package.id, status=ImportStatus.QUEUED,
-                                                    module=True, executor_username=username, version=settings.version)
-        if batch_import_id:
-            await BatchImportPackage.create(import_id=package_module_import.id, batch_import_id=batch_import_id)
-        pkg_list.append((package.id, package_module_import.id))
+        package_module_import.pending_dependencies = await Import.filter(
+            parent_import_id=package_module_import.id).count()
+        await package_module_import.save()
+        if package_module_import.pending_dependencies == 0:
+            ready.append((package.id, package_module_import.id, True))
+
+    return ready
+
+
+def build_extras(body: dict) -> dict:
+    extras = {}
 
-    return pkg_list
+    if body.get("force_tag"):
+        extras["force_tag"] = body.get("force_tag")
+    if body.get("scratch"):
+        extras["scratch"] = True
+    if body.get("arch_override"):
+        extras["arch_override"] = body.get("arch_override")
 
+    return extras
 
+
+# Picks the commits of the latest import that a build request should build.
+# Returns (import commit, mbs) pairs, once a stream branch is seen the following builds are mbs builds too.
+def select_build_commits(package: Package, import_commits: List[ImportCommit], body: dict) -> \
+        List[Tuple[ImportCommit, bool]]:
+    selected = []
+    mbs = False
+
+    only_branch = body.get("only_branch")
+    for import_commit in import_commits:
+        if "-beta" not in import_commit.branch:
+            if only_branch and import_commit.branch != only_branch:
+                continue
+
+            stream_branch_prefix = f"{settings.original_import_branch_prefix}{settings.version}-stream"
+            if import_commit.branch.startswith(stream_branch_prefix):
+                if body.get("ignore_modules"):
+                    continue
+                if package.part_of_module and not package.is_module:
+                    continue
+                mbs = True
+
+            # temporarily skip containeronly streams
+            containeronly_stream_prefix = f"{settings.original_import_branch_prefix}{settings.version}-containeronly-stream"
+            if import_commit.branch.startswith(containeronly_stream_prefix):
+                continue
+
+            selected.append((import_commit, mbs))
+
+            if only_branch:
+                break
+
+    return selected
+
+
+# Checks a whole batch with one query for the packages and one for their imports.
+# Every missing (or with check_imports, never imported) package is reported at once.
 async def batch_list_check(packages, check_imports: bool = False):
+    packages = [dict(package) for package in packages]
+    ids = [package["package_id"] for package in packages if package.get("package_id")]
+    names = [package["package_name"] for package in packages if package.get("package_name")]
+
+    db_packages = await Package.filter(Q(id__in=ids) | Q(name__in=names), repo__not=Repo.MODULAR_CANDIDATE) \
+        .values("id", "name")
+    found_ids = {db_package["id"] for db_package in db_packages}
+    by_name = {db_package["name"]: db_package["id"] for db_package in db_packages}
+
+    imported = set()
+    if check_imports and len(db_packages) > 0:
+        imported = set(await Import.filter(package_id__in=list(found_ids)).distinct().values_list("package_id",
+                                                                                                      flat=True))
+
+    errors = []
     for package in packages:
-        filters = {}
         if package.get("package_id"):
-            filters["id"] = package["package_id"]
-        elif package.get("package_name"):
-            filters["name"] = package["package_name"]
-
-        db_package = await Package.filter(**filters, repo__not=Repo.MODULAR_CANDIDATE).prefetch_related(
-            "imports").first()
-        if not db_package:
-            detail = ""
-            if package.get("package_id"):
-                detail = f"Package with id {package['package_id']} not found"
-            elif package.get("package_name"):
-                detail = f"Package with name {package['package_name']} not found"
-            raise HTTPException(412, detail=detail)
-        elif check_imports and (not db_package.imports or len(db_package.imports) == 0):
-            detail = ""
-            if package.get("package_id"):
-                detail = f"Package with id {package['package_id']} not imported"
-            elif package.get("package_name"):
-                detail = f"Package with name {package['package_name']} not imported"
-            raise HTTPException(412, detail=detail)
+            package_id = package["package_id"] if package["package_id"] in found_ids else None
+            description = f"Package with id {package['package_id']}"
+        else:
+            package_id = by_name.get(package.get("package_name"))
+            description = f"Package with name {package.get('package_name')}"
+
+        if not package_id:
+            errors.append(f"{description} not found")
+        elif check_imports and package_id not in imported:
+            errors.append(f"{description} not imported")
+
+    if len(errors) > 0:
+        raise HTTPException(412, detail="\n".join(errors))
 
 
 def get_user(request: Request) -> dict:
@@ -0,0 +1,261 @@
+#  Copyright (c) 2021 The Distrobuild Authors
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+import asyncio
+
+from functools import partial
+from typing import List, Tuple, Optional, Dict, Any, Awaitable, Callable, Type
+
+from fastapi import HTTPException
+from tortoise import Model
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.expressions import F
+from tortoise.query_utils import Q
+from tortoise.transactions import in_transaction
+
+from distrobuild.common import build_extras, select_build_commits
+from distrobuild.models import Import, ImportCommit, ImportStatus, Package, PackageModule, BatchImportPackage, Repo, \
+    Build, BuildStatus, BatchBuildPackage, BatchImport, BatchBuild
+from distrobuild.settings import settings
+from distrobuild_scheduler import import_package_task, build_package_task, build_idempotency_key, priority_for, \
+    logger
+
+
+# Looks up every package of a batch in one query, in request order.
+# Returns the packages found and the ids/names that don't exist.
+async def resolve_packages(requests: List[Any]) -> Tuple[List[Package], List[str]]:
+    requests = [dict(r) for r in requests]
+    ids = [r["package_id"] for r in requests if r.get("package_id")]
+    names = [r["package_name"] for r in requests if r.get("package_name")]
+
+    packages = await Package.filter(Q(id__in=ids) | Q(name__in=names), repo__not=Repo.MODULAR_CANDIDATE).all()
+    by_id = {package.id: package for package in packages}
+    by_name = {package.name: package for package in packages}
+
+    resolved = []
+    missing = []
+    for r in requests:
+        package = by_id.get(r["package_id"]) if r.get("package_id") else by_name.get(r.get("package_name"))
+        if not package:
+            missing.append(str(r.get("package_id") or r.get("package_name")))
+            continue
+        resolved.append(package)
+
+    return resolved, missing
+
+
+def raise_if_missing(missing: List[str]):
+    if len(missing) > 0:
+        raise HTTPException(404, detail=f"packages do not exist: {', '.join(missing)}")
+
+
+# Reserves ids from the table's sequence so rows can be bulk inserted with their ids known up front
+async def allocate_ids(connection: BaseDBAsyncClient, table: str, count: int) -> List[int]:
+    if count == 0:
+        return []
+    rows = await connection.execute_query_dict(f"select nextval('{table}_id_seq') as id from generate_series(1, $1)",
+                                               [count])
+    return [row["id"] for row in rows]
+
+
+# (id of the import/build, publishes its message)
+BatchTask = Tuple[int, Callable[[], Awaitable]]
+
+
+# Publishes the messages of a batch and counts them as queued or failed on the batch
+async def publish_batch(batch_model: Type[Model], batch_id: int, tasks: List[BatchTask]):
+    queued = 0
+    failed_ids = []
+    for i in range(0, len(tasks), settings.batch_publish_concurrency):
+        chunk = tasks[i:i + settings.batch_publish_concurrency]
+        results = await asyncio.gather(*[publish() for _, publish in chunk], return_exceptions=True)
+        for (member_id, _), result in zip(chunk, results):
+            if isinstance(result, Exception):
+                logger.error(f"[*] Could not publish message for batch {batch_id}: {result}")
+                failed_ids.append(member_id)
+            else:
+                queued += 1
+
+    if len(failed_ids) > 0:
+        await fail_members(batch_model, failed_ids)
+    await batch_model.filter(id=batch_id).update(queued=F("queued") + queued, failed=F("failed") + len(failed_ids))
+
+
+# Members whose message couldn't be published would stay queued without anything to run them. They are marked
+# as failed, together with the imports waiting on them, so retry_failed picks them up.
+async def fail_members(batch_model: Type[Model], ids: List[int]):
+    if batch_model is BatchImport:
+        while len(ids) > 0:
+            await Import.filter(id__in=ids, status=ImportStatus.QUEUED).update(status=ImportStatus.FAILED)
+            parent_ids = await Import.filter(id__in=ids).values_list("parent_import_id", flat=True)
+            ids = list({parent_id for parent_id in parent_ids if parent_id})
+    else:
+        await Build.filter(id__in=ids, status=BuildStatus.QUEUED).update(status=BuildStatus.FAILED)
+
+
+# Messages for the imports of a batch that don't wait on other imports
+def import_tasks(imports: List[Import], allow_stream_branches: bool) -> List[BatchTask]:
+    return [
+        (package_import.id, partial(import_package_task, package_import.package_id, package_import.id,
+                                    package_import.module, allow_stream_branches, priority_for(True)))
+        for package_import in imports
+        if package_import.pending_dependencies == 0
+    ]
+
+
+def build_tasks(builds: List[Build], token: Optional[str]) -> List[BatchTask]:
+    return [
+        (build.id, partial(build_package_task, build.package_id, build.id, token if build.mbs else None,
+                           build_idempotency_key(build.package_id, build.import_commit_id, build.scratch,
+                                                 build.arch_override, build.force_tag),
+                           priority_for(True)))
+        for build in builds
+    ]
+
+
+async def count_expanded(connection: BaseDBAsyncClient, batch_model: Type[Model], batch_id: int, expanded: int,
+                         failed: int):
+    await batch_model.filter(id=batch_id).using_db(connection).update(expanded=F("expanded") + expanded,
+                                                                      failed=F("failed") + failed)
+
+
+# Same import graph as create_import_order, planned in memory for the whole batch and written with a few inserts.
+# skipped requested packages (that don't exist) count as expanded and failed.
+# Returns the messages to publish with publish_batch once the transaction committed.
+async def bulk_import_packages(batch_import_id: int, packages: List[Package], username: str,
+                               allow_stream_branches: bool, skipped: int = 0) -> List[BatchTask]:
+    # (package, module, index of the parent import)
+    nodes: List[Tuple[Package, bool, Optional[int]]] = []
+    # package id -> index of its (non module) import, None while it's still in the frontier
+    planned_packages: Dict[int, Optional[int]] = {}
+
+    frontier: List[Tuple[Package, Optional[int]]] = [(package, None) for package in packages]
+    while len(frontier) > 0:
+        module_nodes = []
+        for package, parent in frontier:
+            component_parent = parent
+            if package.is_module:
+                nodes.append((package, True, parent))
+                component_parent = len(nodes) - 1
+                module_nodes.append((package, component_parent))
+            if package.is_package:
+                nodes.append((package, False, component_parent))
+                planned_packages[package.id] = len(nodes) - 1
+
+        frontier = []
+        if len(module_nodes) == 0:
+            break
+
+        module_ids = [package.id for package, _ in module_nodes]
+        package_modules = await PackageModule.filter(module_parent_package_id__in=module_ids).all()
+        subpackage_ids = list({pm.package_id for pm in package_modules})
+        imported = set(await Import.filter(package_id__in=subpackage_ids).distinct().values_list("package_id",
+                                                                                                 flat=True))
+        subpackages = {package.id: package for package in await Package.filter(id__in=subpackage_ids).all()}
+
+        for package, module_index in module_nodes:
+            for pm in package_modules:
+                if pm.module_parent_package_id != package.id:
+                    continue
+                if pm.package_id in imported:
+                    continue
+                if pm.package_id in planned_packages:
+                    # requested in the same batch, the module still has to wait for it.
+                    # an import has a single parent, so one that already waits on a module stays there
+                    index = planned_packages[pm.package_id]
+                    if index is not None and nodes[index][2] is None:
+                        nodes[index] = (nodes[index][0], False, module_index)
+                    continue
+                planned_packages[pm.package_id] = None
+                frontier.append((subpackages[pm.package_id], module_index))
+
+    pending = [0] * len(nodes)
+    for _, _, parent in nodes:
+        if parent is not None:
+            pending[parent] += 1
+
+    async with in_transaction() as connection:
+        ids = await allocate_ids(connection, "imports", len(nodes))
+        imports = [
+            Import(id=ids[i], package_id=package.id, status=ImportStatus.QUEUED, module=module,
+                   executor_username=username, version=settings.version,
+                   parent_import_id=ids[parent] if parent is not None else None,
+                   pending_dependencies=pending[i])
+            for i, (package, module, parent) in enumerate(nodes)
+        ]
+        await Import.bulk_create(imports, using_db=connection)
+        await BatchImportPackage.bulk_create([
+            BatchImportPackage(import_id=import_id, batch_import_id=batch_import_id) for import_id in ids
+        ], using_db=connection)
+        await count_expanded(connection, BatchImport, batch_import_id, len(packages) + skipped, skipped)
+
+    return import_tasks(imports, allow_stream_branches)
+
+
+# Builds the latest import (or the latest succeeded build for scratch builds) of every package.
+# Returns the messages to publish with publish_batch once the transaction committed.
+async def bulk_queue_builds(batch_build_id: int, packages: List[Package], username: str, token: Optional[str],
+                            options: dict, skipped: int = 0) -> List[BatchTask]:
+    extras = build_extras(options)
+    package_ids = [package.id for package in packages]
+    commits_by_package: Dict[int, List[ImportCommit]] = {}
+
+    async with in_transaction() as connection:
+        if options.get("scratch"):
+            rows = await connection.execute_query_dict(
+                "select distinct on (package_id) package_id, import_commit_id from builds "
+                "where package_id = any($1) and status = $2 order by package_id, created_at desc",
+                [package_ids, BuildStatus.SUCCEEDED.value])
+            commits = {c.id: c for c in
+                       await ImportCommit.filter(id__in=[row["import_commit_id"] for row in rows]).all()}
+            for row in rows:
+                commits_by_package[row["package_id"]] = [commits[row["import_commit_id"]]]
+        else:
+            module_filter = " and module = false" if options.get("ignore_modules") else ""
+            rows = await connection.execute_query_dict(
+                "select distinct on (package_id) package_id, id from imports "
+                f"where package_id = any($1){module_filter} order by package_id, created_at desc",
+                [package_ids])
+            import_packages = {row["id"]: row["package_id"] for row in rows}
+            for commit in await ImportCommit.filter(import__id__in=list(import_packages.keys())).order_by("id").all():
+                commits_by_package.setdefault(import_packages[commit.import__id], []).append(commit)
+
+        # (package, import commit, mbs)
+        planned: List[Tuple[Package, ImportCommit, bool]] = []
+        for package in packages:
+            if package.repo == Repo.MODULAR_CANDIDATE:
+                continue
+            for import_commit, mbs in select_build_commits(package, commits_by_package.get(package.id, []), options):
+                planned.append((package, import_commit, mbs))
+
+        ids = await allocate_ids(connection, "builds", len(planned))
+        builds = [
+            Build(id=ids[i], package_id=package.id, status=BuildStatus.QUEUED, executor_username=username,
+                  point_release=f"{settings.version}_{settings.default_point_release}",
+                  import_commit_id=import_commit.id, mbs=mbs, **extras)
+            for i, (package, import_commit, mbs) in enumerate(planned)
+        ]
+        await Build.bulk_create(builds, using_db=connection)
+        await BatchBuildPackage.bulk_create([
+            BatchBuildPackage(build_id=build_id, batch_build_id=batch_build_id) for build_id in ids
+        ], using_db=connection)
+        await count_expanded(connection, BatchBuild, batch_build_id, len(packages) + skipped, skipped)
+
+    return build_tasks(builds, token)
@@ -0,0 +1,134 @@
+#  Copyright (c) 2021 The Distrobuild Authors
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+import base64
+import json
+
+from datetime import datetime
+from typing import Generic, List, Optional, Tuple, TypeVar, Callable, Awaitable
+
+from fastapi import HTTPException, Query
+from fastapi_pagination import resolve_params
+from pydantic import BaseModel
+from pydantic.generics import GenericModel
+from tortoise import Tortoise, fields
+from tortoise.query_utils import Q
+from tortoise.queryset import QuerySet
+
+T = TypeVar("T")
+
+
+class CursorParams(BaseModel):
+    cursor: Optional[str]
+    size: int
+    estimate: bool
+
+
+def cursor_params(cursor: Optional[str] = Query(None, description="Cursor returned with the previous page"),
+                  size: int = Query(50, gt=0, le=100, description="Page size"),
+                  estimate: bool = Query(False, description="Include an estimated total")) -> CursorParams:
+    return CursorParams(cursor=cursor, size=size, estimate=estimate)
+
+
+class CursorPage(GenericModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[str]
+    estimated_total: Optional[int]
+
+
+def encode_cursor(values: list) -> str:
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(query: QuerySet, keys: List[Tuple[str, bool]], cursor: str) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError("cursor doesn't match the ordering")
+
+        decoded = []
+        for (key, _), value in zip(keys, values):
+            if value is not None and isinstance(query.model._meta.fields_map[key], fields.DatetimeField):
+                value = datetime.fromisoformat(value)
+            decoded.append(value)
+        return decoded
+    except ValueError:
+        raise HTTPException(400, detail="invalid cursor")
+
+
+# Rows that come after values in the ordering of keys. Postgres sorts NULLs last ascending and first descending.
+def after(query: QuerySet, keys: List[Tuple[str, bool]], values: list) -> Q:
+    (key, descending), value = keys[0], values[0]
+    rest = after(query, keys[1:], values[1:]) if len(keys) > 1 else None
+
+    if value is None:
+        if descending:
+            return Q(**{f"{key}__not_isnull": True}) | (Q(**{f"{key}__isnull": True}) & rest)
+        return Q(**{f"{key}__isnull": True}) & rest
+
+    condition = Q(**{f"{key}__lt" if descending else f"{key}__gt": value})
+    if rest:
+        condition |= Q(**{key: value}) & rest
+    if not descending and query.model._meta.fields_map[key].null:
+        condition |= Q(**{f"{key}__isnull": True})
+    return condition
+
+
+# Estimated row count of the query from the planner, cheap even on large tables
+async def estimate_count(query: QuerySet) -> int:
+    rows = await Tortoise.get_connection("default").execute_query_dict(f"explain (format json) {query.sql()}")
+    plan = rows[0]["QUERY PLAN"]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+# Keyset pagination, keys are (field, descending) pairs and the last key has to be unique.
+# Every page costs the same however deep it is, unlike OFFSET.
+# fetch turns the page query into rows (dicts that contain the keys), the models are loaded without it.
+async def paginate_cursor(query: QuerySet, keys: List[Tuple[str, bool]], params: CursorParams,
+                          fetch: Optional[Callable[[QuerySet], Awaitable[List[dict]]]] = None) -> CursorPage:
+    estimated_total = await estimate_count(query) if params.estimate else None
+
+    if params.cursor:
+        query = query.filter(after(query, keys, decode_cursor(query, keys, params.cursor)))
+
+    query = query.order_by(*[f"-{key}" if descending else key for key, descending in keys]).limit(params.size + 1)
+    items = await fetch(query) if fetch else await query
+
+    next_cursor = None
+    if len(items) > params.size:
+        items = items[:params.size]
+        last = items[-1]
+        next_cursor = encode_cursor([last[key] if fetch else getattr(last, key) for key, _ in keys])
+
+    return CursorPage(items=items, next_cursor=next_cursor, estimated_total=estimated_total)
+
+
+# Offset pagination like fastapi_pagination's paginate for rows from fetch, which are returned without validation
+async def paginate_values(query: QuerySet, fetch: Callable[[QuerySet], Awaitable[List[dict]]]) -> dict:
+    params = resolve_params()
+    raw_params = params.to_raw_params()
+
+    total = await query.count()
+    items = await fetch(query.offset(raw_params.offset).limit(raw_params.limit))
+
+    return dict(items=items, total=total, page=params.page, size=params.size)
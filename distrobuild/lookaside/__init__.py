@@ -18,12 +18,24 @@
 #  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 #  SOFTWARE.
 
+import asyncio
+import os
+import tempfile
+import time
+
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from enum import Enum
-from typing import BinaryIO
+from typing import AsyncIterator, Optional
 
+import aiofiles
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 from google.cloud import storage
+from starlette.concurrency import run_in_threadpool
+
+from distrobuild.lookaside.cache import LookasideCache
 
 
 class LookasideUploadException(Exception):
@@ -36,31 +48,176 @@ class LookasideBackend(str, Enum):
     GCS = "gcs"
 
 
+@dataclass
+class LookasideStats:
+    uploads: int = 0
+    failed_uploads: int = 0
+    in_flight: int = 0
+    bytes: int = 0
+    seconds: float = 0
+
+    # average bytes per second of the finished uploads
+    @property
+    def throughput(self) -> float:
+        return self.bytes / self.seconds if self.seconds else 0
+
+
+# The backends are blocking clients (boto3 and google-cloud-storage don't have async ones),
+# every call into them runs in the threadpool so uploads never block the event loop.
 class Lookaside:
     backend: LookasideBackend
 
-    def __init__(self, url: str):
+    def __init__(self, url: str, chunk_size: int = 8 * 1024 * 1024, staging_dir: Optional[str] = None,
+                 max_concurrency: int = 4, cache: Optional[LookasideCache] = None):
+        self.chunk_size = chunk_size
+        self.staging_dir = staging_dir
+        self.max_concurrency = max_concurrency
+        # blobs read from S3/GCS are kept here, FILE blobs are read in place
+        self.cache = cache
+        self.stats = LookasideStats()
+        # created on first use, it has to belong to the running event loop
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
         if url.startswith("file://"):
             self.backend = LookasideBackend.FILE
             self.dir = url[len("file://"):]
+            # staged files are renamed into place, so they have to be on the same filesystem
+            self.staging_dir = self.dir
         elif url.startswith("s3://"):
             self.backend = LookasideBackend.S3
             self.s3 = boto3.client("s3")
             self.bucket = url[len("s3://"):]
+            self.transfer_config = TransferConfig(multipart_threshold=chunk_size, multipart_chunksize=chunk_size)
         elif url.startswith("gs://"):
             self.backend = LookasideBackend.GCS
             self.gcs = storage.Client().bucket(url[len("gs://"):])
 
-    def upload(self, f: BinaryIO, name: str):
+    # Temporary file an upload is written to while it's hashed, removed unless commit moved it into place
+    @asynccontextmanager
+    async def staging_file(self) -> AsyncIterator:
+        fd, path = await run_in_threadpool(tempfile.mkstemp, dir=self.staging_dir, prefix=".upload-")
+        os.close(fd)
+        try:
+            async with aiofiles.open(path, "wb") as staged:
+                yield staged
+        finally:
+            if os.path.exists(path):
+                await run_in_threadpool(os.unlink, path)
+
+    # Stores a staged file under name, at most max_concurrency at a time
+    async def commit(self, staged, name: str):
+        await staged.flush()
+        size = await staged.tell()
+
+        if not self._semaphore:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async with self._semaphore:
+            self.stats.in_flight += 1
+            start = time.monotonic()
+            try:
+                await run_in_threadpool(self._store, staged.name, name)
+            except Exception:
+                self.stats.failed_uploads += 1
+                raise
+            else:
+                self.stats.uploads += 1
+                self.stats.bytes += size
+                self.stats.seconds += time.monotonic() - start
+            finally:
+                self.stats.in_flight -= 1
+
+    def _store(self, path: str, name: str):
         if self.backend == LookasideBackend.FILE:
-            file_content = f.read()
-            with open(f"{self.dir}/{name}", "wb") as f2:
-                f2.write(file_content)
+            # temporary files are only readable by their owner, blobs get the permissions open() would give them
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(path, 0o666 & ~umask)
+            os.replace(path, f"{self.dir}/{name}")
         elif self.backend == LookasideBackend.S3:
             try:
-                self.s3.upload_fileobj(f, self.bucket, name)
+                # multipart upload, the parts are sent by boto3's own transfer threads
+                self.s3.upload_file(path, self.bucket, name, Config=self.transfer_config)
             except ClientError as e:
                 raise LookasideUploadException(e)
+        elif self.backend == LookasideBackend.GCS:
+            # a chunk_size makes the client use a resumable upload sending one chunk at a time
+            blob = self.gcs.blob(name, chunk_size=self.chunk_size)
+            blob.upload_from_filename(path)
+
+    # Size of the blob, None if it doesn't exist
+    async def size(self, name: str) -> Optional[int]:
+        path = await self._local_path(name)
+        if path:
+            try:
+                return (await run_in_threadpool(os.stat, path)).st_size
+            except FileNotFoundError:
+                # evicted from the cache in the meantime, the backend still has it
+                if self.backend == LookasideBackend.FILE:
+                    return None
+
+        if self.backend == LookasideBackend.S3:
+            try:
+                head = await run_in_threadpool(self.s3.head_object, Bucket=self.bucket, Key=name)
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                    return None
+                raise
+            return head["ContentLength"]
+        elif self.backend == LookasideBackend.GCS:
+            blob = await run_in_threadpool(self.gcs.get_blob, name)
+            return blob.size if blob else None
+
+    # Streams bytes start to end (inclusive) of the blob in chunk_size pieces
+    async def read(self, name: str, start: int, end: int) -> AsyncIterator[bytes]:
+        if self.backend == LookasideBackend.FILE:
+            async for chunk in self._read_file(f"{self.dir}/{name}", start, end):
+                yield chunk
+        elif self.cache:
+            async with self.cache.reading(name, self._download) as path:
+                async for chunk in self._read_file(path, start, end):
+                    yield chunk
+        elif self.backend == LookasideBackend.S3:
+            response = await run_in_threadpool(self.s3.get_object, Bucket=self.bucket, Key=name,
+                                               Range=f"bytes={start}-{end}")
+            body = response["Body"]
+            try:
+                while True:
+                    chunk = await run_in_threadpool(body.read, self.chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                body.close()
         elif self.backend == LookasideBackend.GCS:
             blob = self.gcs.blob(name)
-            blob.upload_from_file(f)
+            position = start
+            while position <= end:
+                chunk_end = min(position + self.chunk_size - 1, end)
+                yield await run_in_threadpool(blob.download_as_bytes, start=position, end=chunk_end)
+                position = chunk_end + 1
+
+    async def _read_file(self, path: str, start: int, end: int) -> AsyncIterator[bytes]:
+        async with aiofiles.open(path, "rb") as f:
+            await f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await f.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    # Path of the blob on disk if it's there
+    async def _local_path(self, name: str) -> Optional[str]:
+        if self.backend == LookasideBackend.FILE:
+            return f"{self.dir}/{name}"
+        if not self.cache:
+            return None
+        return await self.cache.get(name)
+
+    def _download(self, name: str, path: str):
+        if self.backend == LookasideBackend.S3:
+            self.s3.download_file(self.bucket, name, path, Config=self.transfer_config)
+        elif self.backend == LookasideBackend.GCS:
+            self.gcs.blob(name, chunk_size=self.chunk_size).download_to_filename(path)
@@ -0,0 +1,121 @@
+#  Copyright (c) 2021 The Distrobuild Authors
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+import asyncio
+import os
+import tempfile
+import threading
+
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+
+# On-disk LRU cache for blobs, the mtime of an entry is its last use.
+# Entries are only ever added whole (downloaded to a temporary file and renamed), so readers never see partial blobs.
+class LookasideCache:
+    def __init__(self, directory: str, max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+        # one download per blob, concurrent requests for it wait for that download
+        self._downloads: Dict[str, asyncio.Task] = {}
+        # name -> number of reads in progress, eviction skips these. Eviction runs in the threadpool, hence the lock
+        self._readers: Dict[str, int] = {}
+        self._readers_lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    async def get(self, name: str) -> Optional[str]:
+        path = self.path(name)
+        try:
+            await run_in_threadpool(os.utime, path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    # Returns the path of the cached blob, download(name, path) writes it to path if it isn't cached yet
+    async def get_or_fill(self, name: str, download: Callable[[str, str], None]) -> str:
+        path = await self.get(name)
+        if path:
+            return path
+
+        # the download runs as its own task, a cancelled requester (the client went away) doesn't cancel it
+        # for the other requests waiting on it
+        if name not in self._downloads:
+            self._downloads[name] = asyncio.ensure_future(self._download(name, download))
+        return await asyncio.shield(self._downloads[name])
+
+    async def _download(self, name: str, download: Callable[[str, str], None]) -> str:
+        try:
+            await run_in_threadpool(self._fill, name, download)
+            return self.path(name)
+        finally:
+            del self._downloads[name]
+
+    # Like get_or_fill, but the blob can't be evicted until the block is left
+    @asynccontextmanager
+    async def reading(self, name: str, download: Callable[[str, str], None]) -> AsyncIterator[str]:
+        with self._readers_lock:
+            self._readers[name] = self._readers.get(name, 0) + 1
+        try:
+            yield await self.get_or_fill(name, download)
+        finally:
+            with self._readers_lock:
+                self._readers[name] -= 1
+                if self._readers[name] == 0:
+                    del self._readers[name]
+
+    def _fill(self, name: str, download: Callable[[str, str], None]):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".download-")
+        os.close(fd)
+        try:
+            download(name, temp_path)
+            os.replace(temp_path, self.path(name))
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+        self._evict(keep=name)
+
+    # Removes the least recently used blobs until the cache fits max_size, keep and blobs being read are never removed
+    def _evict(self, keep: str):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(".") or entry.name == keep or not entry.is_file():
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        size = os.stat(self.path(keep)).st_size + sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            with self._readers_lock:
+                if os.path.basename(path) in self._readers:
+                    continue
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            size -= entry_size
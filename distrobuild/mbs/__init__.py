@@ -18,10 +18,15 @@
 #  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 #  SOFTWARE.
 
-from dataclasses import dataclass
+import asyncio
+import random
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
 
 import httpx
 
+from distrobuild.common.cache import TTLCache
 from distrobuild.settings import settings
 
 
@@ -37,44 +42,141 @@ class MBSBuildNotFound(Exception):
     pass
 
 
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+
 @dataclass
 class MBSClient:
     mbs_url: str
+    timeout: float = 30
+    max_connections: int = 20
+    retries: int = 3
+    retry_backoff: float = 0.5
+    cache_ttl: float = 30
+    bulk_size: int = 50
+    _client: Optional[httpx.AsyncClient] = field(default=None, init=False, repr=False)
+    _cache: TTLCache = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self._cache = TTLCache(self.cache_ttl)
+
+    async def open(self):
+        if not self._client:
+            self._client = httpx.AsyncClient(
+                http2=True,
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
 
-    async def get_build(self, mbs_id: int):
-        client = httpx.AsyncClient()
-        async with client:
-            r = await client.get(f"{self.mbs_url}/1/module-builds/{mbs_id}")
-
-            if r.status_code == 404:
-                raise MBSBuildNotFound("Build not found")
+    async def close(self):
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+    # Retries with full jitter. Requests that are not idempotent are only retried
+    # if the connection could not be established, so they're never sent twice.
+    async def _request(self, method: str, url: str, idempotent: bool = True, **kwargs) -> httpx.Response:
+        await self.open()
+
+        attempt = 0
+        while True:
+            try:
+                r = await self._client.request(method, url, **kwargs)
+                if not idempotent or r.status_code not in RETRY_STATUS_CODES or attempt >= self.retries:
+                    return r
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+                if attempt >= self.retries:
+                    raise
+            except httpx.TransportError:
+                if not idempotent or attempt >= self.retries:
+                    raise
+
+            await asyncio.sleep(random.uniform(0, self.retry_backoff * 2 ** attempt))
+            attempt += 1
 
-            return r.json()
+    async def get_build(self, mbs_id: int):
+        cached = self._cache.get(mbs_id)
+        if cached:
+            return cached
+
+        r = await self._request("GET", f"{self.mbs_url}/1/module-builds/{mbs_id}")
+
+        if r.status_code == 404:
+            raise MBSBuildNotFound("Build not found")
+
+        build = r.json()
+        self._cache.set(mbs_id, build)
+        return build
+
+    # Fetches all builds that aren't cached yet with filtered list requests of up to `bulk_size` ids.
+    # Builds that don't exist (or don't match `states`) are missing from the result.
+    # The list endpoint isn't trusted to honour repeated `id` filters, so only requested ids are kept
+    # and any id the list didn't return is fetched on its own.
+    async def get_builds(self, mbs_ids: List[int], states: Optional[List[str]] = None) -> Dict[int, dict]:
+        builds = {}
+        missing = []
+        for mbs_id in set(mbs_ids):
+            cached = self._cache.get(mbs_id)
+            if cached and (not states or cached["state_name"] in states):
+                builds[mbs_id] = cached
+            elif not cached:
+                missing.append(mbs_id)
+
+        for i in range(0, len(missing), self.bulk_size):
+            chunk = missing[i:i + self.bulk_size]
+            params = [("verbose", "true"), ("per_page", str(len(chunk)))]
+            params += [("id", str(mbs_id)) for mbs_id in chunk]
+            if states:
+                params += [("state", state) for state in states]
+
+            r = await self._request("GET", f"{self.mbs_url}/1/module-builds/", params=params)
+            r.raise_for_status()
+
+            requested = set(chunk)
+            for build in r.json()["items"]:
+                if build["id"] not in requested:
+                    continue
+                self._cache.set(build["id"], build)
+                builds[build["id"]] = build
+
+            for mbs_id in requested - builds.keys():
+                try:
+                    build = await self.get_build(mbs_id)
+                except MBSBuildNotFound:
+                    continue
+                if not states or build["state_name"] in states:
+                    builds[mbs_id] = build
+
+        return builds
+
+    def invalidate(self, mbs_id: int):
+        self._cache.delete(mbs_id)
 
     async def build(self, token: str, name: str, branch: str, commit: str) -> int:
         scmurl = f"https://{settings.gitlab_host}{settings.repo_prefix}/modules/{name}?#{commit}"
 
-        client = httpx.AsyncClient()
-        async with client:
-            r = await client.post(
-                f"{self.mbs_url}/1/module-builds/",
-                headers={
-                    "Authorization": f"Bearer {token}"
-                },
-                json={
-                    "scmurl": scmurl,
-                    "branch": branch,
-                }
-            )
-
-            if r.status_code == 409:
-                raise MBSConflictException("A MBS conflict occurred")
-            elif r.status_code == 401:
-                raise MBSUnauthorizedException("Not authorized")
-
-            data = r.json()
-
-            if not data.get("id"):
-                raise Exception(data["message"])
-
-            return data["id"]
+        r = await self._request(
+            "POST",
+            f"{self.mbs_url}/1/module-builds/",
+            idempotent=False,
+            headers={
+                "Authorization": f"Bearer {token}"
+            },
+            json={
+                "scmurl": scmurl,
+                "branch": branch,
+            }
+        )
+
+        if r.status_code == 409:
+            raise MBSConflictException("A MBS conflict occurred")
+        elif r.status_code == 401:
+            raise MBSUnauthorizedException("Not authorized")
+
+        data = r.json()
+
+        if not data.get("id"):
+            raise Exception(data["message"])
+
+        return data["id"]
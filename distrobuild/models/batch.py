@@ -25,6 +25,13 @@ from distrobuild.models.build import Import, Build
 class BatchImport(Model):
     id = fields.BigIntField(pk=True)
     created_at = fields.DatetimeField(auto_now_add=True)
+    # progress counters, expanded counts requested packages and queued the messages published for them
+    total = fields.IntField(default=0)
+    expanded = fields.IntField(default=0)
+    queued = fields.IntField(default=0)
+    failed = fields.IntField(default=0)
+    # submitted batch, kept until the scheduler finished expanding it
+    request = fields.JSONField(null=True)
 
     imports: fields.ManyToManyRelation[Import] = fields.ManyToManyField("distrobuild.Import",
                                                                         related_name="batch_imports",
@@ -34,10 +41,18 @@ class BatchImport(Model):
     class Meta:
         table = "batch_imports"
 
+    class PydanticMeta:
+        exclude = ("request",)
+
 
 class BatchBuild(Model):
     id = fields.BigIntField(pk=True)
     created_at = fields.DatetimeField(auto_now_add=True)
+    total = fields.IntField(default=0)
+    expanded = fields.IntField(default=0)
+    queued = fields.IntField(default=0)
+    failed = fields.IntField(default=0)
+    request = fields.JSONField(null=True)
 
     builds: fields.ManyToManyRelation[Build] = fields.ManyToManyField("distrobuild.Build",
                                                                       related_name="batch_builds",
@@ -47,6 +62,9 @@ class BatchBuild(Model):
     class Meta:
         table = "batch_builds"
 
+    class PydanticMeta:
+        exclude = ("request",)
+
 
 class BatchImportPackage(Model):
     id = fields.BigIntField(pk=True)
@@ -31,6 +31,11 @@ class Import(Model):
     module = fields.BooleanField(default=False)
     version = fields.IntField()
     executor_username = fields.CharField(max_length=255)
+    # module imports wait for all imports that point at them to finish
+    parent_import_id = fields.BigIntField(null=True)
+    pending_dependencies = fields.IntField(default=0)
+    # set once the import counted itself off the parent's pending_dependencies
+    released = fields.BooleanField(default=False)
 
     commits: fields.ManyToManyRelation["ImportCommit"] = fields.ManyToManyField("distrobuild.ImportCommit",
                                                                                 related_name="imports",
@@ -29,3 +29,5 @@ class LookasideBlob(Model):
 
     class Meta:
         table = "lookaside_blobs"
+        # TextField can't be unique itself, the index is lookaside_blobs_sum_idx
+        unique_together = (("sum",),)
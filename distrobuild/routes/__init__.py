@@ -20,7 +20,7 @@
 
 from fastapi import APIRouter
 
-from distrobuild.routes import builds, imports, packages, bootstrap, oidc, batches, lookaside
+from distrobuild.routes import builds, imports, packages, bootstrap, oidc, batches, lookaside, scheduler
 
 _base_router = APIRouter(prefix="/api")
 
@@ -33,5 +33,6 @@ def register_routes(app):
     _base_router.include_router(imports.router)
     _base_router.include_router(batches.router)
     _base_router.include_router(lookaside.router)
+    _base_router.include_router(scheduler.router)
 
     app.include_router(_base_router)
@@ -18,31 +18,40 @@
 #  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 #  SOFTWARE.
 
-from typing import List, Optional
+from datetime import datetime
+from typing import List, Optional, Dict, Type
 
 from fastapi import APIRouter, Depends, Request, HTTPException
-from fastapi_pagination import Page, pagination_params
-from fastapi_pagination.ext.tortoise import paginate
+from fastapi.responses import ORJSONResponse
+from fastapi_pagination import Page, pagination_params, resolve_params, create_page
 from pydantic import BaseModel
+from tortoise import Tortoise, Model
 
 from distrobuild.common import batch_list_check, get_user
-from distrobuild.models import BatchImport, BatchBuild, ImportStatus, BuildStatus
-from distrobuild.routes.builds import BuildRequest, queue_build
-from distrobuild.routes.imports import ImportRequest, import_package_route
-from distrobuild.serialize import BatchImport_Pydantic, BatchBuild_Pydantic
-from distrobuild_scheduler import merge_scratch_task
+from distrobuild.common.pagination import paginate_values
+from distrobuild.common.bulk import resolve_packages, raise_if_missing, bulk_import_packages, bulk_queue_builds, \
+    publish_batch
+from distrobuild.models import BatchImport, BatchBuild, Import, Build, ImportStatus, BuildStatus
+from distrobuild.routes.builds import BuildRequest
+from distrobuild.routes.imports import ImportRequest
+from distrobuild.serialize import BatchImport_Pydantic, BatchBuild_Pydantic, ImportListItem, BuildListItem, \
+    import_list_items, build_list_items
+from distrobuild_scheduler import merge_scratch_task, expand_batch_task, priority_for, BATCH_IMPORT, BATCH_BUILD
 
 router = APIRouter(prefix="/batches")
 
 
 class BatchImportRequest(BaseModel):
     should_precheck: bool = True
+    # return right away and let the scheduler create the imports
+    background: bool = False
     allow_stream_branches: bool = False
     packages: List[ImportRequest]
 
 
 class BatchBuildRequest(BaseModel):
     should_precheck: bool = True
+    background: bool = False
     ignore_modules: bool = False
     scratch: bool = False
     arch_override: Optional[str]
@@ -54,30 +63,124 @@ class NewBatchResponse(BaseModel):
     id: int
 
 
-@router.get("/imports/", response_model=Page[BatchImport_Pydantic], dependencies=[Depends(pagination_params)])
+class BatchProgress(BaseModel):
+    total: int
+    expanded: int
+    queued: int
+    failed: int
+
+
+class BatchSummary(BatchProgress):
+    id: int
+    created_at: datetime
+    members: int
+    # member count per import/build status
+    statuses: Dict[str, int]
+    executor_username: Optional[str]
+
+
+# batch model -> (link table, batch column, member column, member table)
+BATCH_MEMBERS = {
+    BatchImport: ("batch_import_packages", "batch_import_id", "import_id", "imports"),
+    BatchBuild: ("batch_build_packages", "batch_build_id", "build_id", "builds"),
+}
+
+
+# Counts the members of every batch by status with one GROUP BY instead of loading them
+async def summarize_batches(batch_model: Type[Model], batches: List[dict]) -> List[BatchSummary]:
+    link_table, batch_column, member_column, member_table = BATCH_MEMBERS[batch_model]
+
+    rows = []
+    if len(batches) > 0:
+        rows = await Tortoise.get_connection("default").execute_query_dict(
+            f"select l.{batch_column} as batch_id, m.status, count(*) as count, "
+            f"min(m.executor_username) as executor_username from {link_table} l "
+            f"join {member_table} m on m.id = l.{member_column} "
+            f"where l.{batch_column} = any($1) group by l.{batch_column}, m.status",
+            [[batch["id"] for batch in batches]])
+
+    summaries = {batch["id"]: BatchSummary(**batch, members=0, statuses={}) for batch in batches}
+    for row in rows:
+        summary = summaries[row["batch_id"]]
+        summary.members += row["count"]
+        summary.statuses[row["status"]] = row["count"]
+        if not summary.executor_username or row["executor_username"] < summary.executor_username:
+            summary.executor_username = row["executor_username"]
+
+    return list(summaries.values())
+
+
+async def paginate_summaries(batch_model: Type[Model]) -> Page[BatchSummary]:
+    params = resolve_params()
+    raw_params = params.to_raw_params()
+
+    query = batch_model.all().order_by("-created_at")
+    total = await query.count()
+    batches = await query.offset(raw_params.offset).limit(raw_params.limit).values(
+        "id", "created_at", "total", "expanded", "queued", "failed")
+
+    return create_page(await summarize_batches(batch_model, batches), total, params)
+
+
+async def get_summary(batch_model: Type[Model], batch_id: int) -> BatchSummary:
+    batches = await batch_model.filter(id=batch_id).values("id", "created_at", "total", "expanded", "queued",
+                                                           "failed")
+    if len(batches) == 0:
+        raise HTTPException(404, detail="batch does not exist")
+    return (await summarize_batches(batch_model, batches))[0]
+
+
+@router.get("/imports/", response_model=Page[BatchSummary], dependencies=[Depends(pagination_params)])
 async def list_batch_imports():
-    return await paginate(
-        BatchImport.all().prefetch_related(
-            "imports", "imports__package", "imports__commits").order_by("-created_at"))
+    return await paginate_summaries(BatchImport)
 
 
 @router.post("/imports/", response_model=NewBatchResponse)
 async def batch_import_package(request: Request, body: BatchImportRequest):
-    get_user(request)
+    user = get_user(request)
 
     if body.should_precheck:
         await batch_list_check(body.packages)
 
-    batch = await BatchImport.create()
+    if body.background:
+        batch = await BatchImport.create(total=len(body.packages), request={
+            "packages": [dict(package) for package in body.packages],
+            "username": user["preferred_username"],
+            "allow_stream_branches": body.allow_stream_branches,
+        })
+        await expand_batch_task(BATCH_IMPORT, batch.id, priority_for(True))
+        return NewBatchResponse(id=batch.id)
 
-    for build_request in body.packages:
-        await import_package_route(request,
-                                   dict(**dict(build_request), allow_stream_branches=body.allow_stream_branches),
-                                   batch.id)
+    packages, missing = await resolve_packages(body.packages)
+    raise_if_missing(missing)
+    batch = await BatchImport.create(total=len(body.packages))
+
+    tasks = await bulk_import_packages(batch.id, packages, user["preferred_username"], body.allow_stream_branches)
+    await publish_batch(BatchImport, batch.id, tasks)
 
     return NewBatchResponse(id=batch.id)
 
 
+@router.get("/imports/{batch_import_id}/progress", response_model=BatchProgress)
+async def get_batch_import_progress(batch_import_id: int):
+    progress = await BatchImport.filter(id=batch_import_id).values("total", "expanded", "queued", "failed")
+    if len(progress) == 0:
+        raise HTTPException(404, detail="batch import does not exist")
+    return progress[0]
+
+
+@router.get("/imports/{batch_import_id}/summary", response_model=BatchSummary)
+async def get_batch_import_summary(batch_import_id: int):
+    return await get_summary(BatchImport, batch_import_id)
+
+
+@router.get("/imports/{batch_import_id}/imports", response_model=Page[ImportListItem], response_class=ORJSONResponse,
+            dependencies=[Depends(pagination_params)])
+async def list_batch_import_members(batch_import_id: int):
+    return ORJSONResponse(await paginate_values(
+        Import.filter(batch_imports__id=batch_import_id).order_by("-created_at", "-id"), import_list_items))
+
+
 @router.get("/imports/{batch_import_id}", response_model=BatchImport_Pydantic)
 async def get_batch_import(batch_import_id: int):
     return await BatchImport_Pydantic.from_queryset_single(BatchImport.filter(id=batch_import_id).first())
@@ -113,30 +216,61 @@ async def retry_failed_batch_imports(request: Request, batch_import_id: int):
     return await batch_import_package(request, BatchImportRequest(packages=packages))
 
 
-@router.get("/builds/", response_model=Page[BatchBuild_Pydantic], dependencies=[Depends(pagination_params)])
+@router.get("/builds/", response_model=Page[BatchSummary], dependencies=[Depends(pagination_params)])
 async def list_batch_builds():
-    return await paginate(
-        BatchBuild.all().prefetch_related(
-            "builds", "builds__package", "builds__import_commit").order_by(
-            "-created_at"))
+    return await paginate_summaries(BatchBuild)
 
 
 @router.post("/builds/", response_model=NewBatchResponse)
 async def batch_queue_build(request: Request, body: BatchBuildRequest):
-    get_user(request)
+    user = get_user(request)
 
     if body.should_precheck:
         await batch_list_check(body.packages, True)
 
-    batch = await BatchBuild.create()
+    options = dict(ignore_modules=body.ignore_modules, scratch=body.scratch, arch_override=body.arch_override,
+                   force_tag=body.force_tag)
 
-    for build_request in body.packages:
-        await queue_build(request, dict(**dict(build_request), ignore_modules=body.ignore_modules, scratch=body.scratch,
-                                        arch_override=body.arch_override, force_tag=body.force_tag), batch.id)
+    if body.background:
+        batch = await BatchBuild.create(total=len(body.packages), request={
+            "packages": [dict(package) for package in body.packages],
+            "username": user["preferred_username"],
+            "options": options,
+        })
+        await expand_batch_task(BATCH_BUILD, batch.id, priority_for(True), request.session.get("token"))
+        return NewBatchResponse(id=batch.id)
+
+    packages, missing = await resolve_packages(body.packages)
+    raise_if_missing(missing)
+    batch = await BatchBuild.create(total=len(body.packages))
+
+    tasks = await bulk_queue_builds(batch.id, packages, user["preferred_username"], request.session.get("token"),
+                                    options)
+    await publish_batch(BatchBuild, batch.id, tasks)
 
     return NewBatchResponse(id=batch.id)
 
 
+@router.get("/builds/{batch_build_id}/progress", response_model=BatchProgress)
+async def get_batch_build_progress(batch_build_id: int):
+    progress = await BatchBuild.filter(id=batch_build_id).values("total", "expanded", "queued", "failed")
+    if len(progress) == 0:
+        raise HTTPException(404, detail="batch build does not exist")
+    return progress[0]
+
+
+@router.get("/builds/{batch_build_id}/summary", response_model=BatchSummary)
+async def get_batch_build_summary(batch_build_id: int):
+    return await get_summary(BatchBuild, batch_build_id)
+
+
+@router.get("/builds/{batch_build_id}/builds", response_model=Page[BuildListItem], response_class=ORJSONResponse,
+            dependencies=[Depends(pagination_params)])
+async def list_batch_build_members(batch_build_id: int):
+    return ORJSONResponse(await paginate_values(
+        Build.filter(batch_builds__id=batch_build_id).order_by("-created_at", "-id"), build_list_items))
+
+
 @router.get("/builds/{batch_build_id}", response_model=BatchBuild_Pydantic)
 async def get_batch_build(batch_build_id: int):
     return await BatchBuild_Pydantic.from_queryset_single(BatchBuild.filter(id=batch_build_id).first())
@@ -167,7 +301,7 @@ async def merge_batch_build(request: Request, batch_build_id: int):
 
     for build in batch_build_obj.builds:
         if build.scratch and not build.scratch_merged:
-            await merge_scratch_task(build.id)
+            await merge_scratch_task(build.id, priority_for(True))
 
     return {}
 
@@ -62,7 +62,7 @@ async def bootstrap_modules(request: Request):
 async def import_from_koji(request: Request):
     user = get_user(request)
 
-    all_koji_builds = koji_session.listBuilds()
+    all_koji_builds = await koji_session.listBuilds()
 
     packages_without_builds = await Package.filter(last_build__isnull=True).all()
     for package in packages_without_builds:
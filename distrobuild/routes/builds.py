@@ -21,16 +21,17 @@
 from typing import Optional, Dict
 
 from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import ORJSONResponse
 from fastapi_pagination import Page, pagination_params
-from fastapi_pagination.ext.tortoise import paginate
 from pydantic import BaseModel, validator
 
-from distrobuild.common import gen_body_filters, get_user
+from distrobuild.common import gen_body_filters, get_user, build_extras, select_build_commits
+from distrobuild.common.pagination import CursorPage, CursorParams, cursor_params, paginate_cursor, paginate_values
 from distrobuild.models import Build, Import, ImportCommit, Package, PackageModule, BuildStatus, Repo, BatchBuildPackage
-from distrobuild.serialize import Build_Pydantic, BuildGeneral_Pydantic
+from distrobuild.serialize import Build_Pydantic, BuildListItem, build_list_items
 from distrobuild.session import message_cipher
 from distrobuild.settings import settings
-from distrobuild_scheduler import build_package_task, merge_scratch_task
+from distrobuild_scheduler import build_package_task, merge_scratch_task, priority_for, build_idempotency_key
 
 router = APIRouter(prefix="/builds")
 
@@ -51,9 +52,16 @@ class BuildRequest(BaseModel):
         return package_name
 
 
-@router.get("/", response_model=Page[BuildGeneral_Pydantic], dependencies=[Depends(pagination_params)])
+@router.get("/", response_model=Page[BuildListItem], response_class=ORJSONResponse,
+            dependencies=[Depends(pagination_params)])
 async def list_builds():
-    return await paginate(Build.all().order_by("-created_at").prefetch_related("package", "import_commit"))
+    return ORJSONResponse(await paginate_values(Build.all().order_by("-created_at", "-id"), build_list_items))
+
+
+@router.get("/cursor/", response_model=CursorPage[BuildListItem], response_class=ORJSONResponse)
+async def list_builds_cursor(params: CursorParams = Depends(cursor_params)):
+    page = await paginate_cursor(Build.all(), [("created_at", True), ("id", True)], params, build_list_items)
+    return ORJSONResponse(dict(page))
 
 
 @router.get("/{build_id}", response_model=Build_Pydantic)
@@ -102,15 +110,10 @@ async def queue_build(request: Request, body: Dict[str, BuildRequest], batch_bui
     if package.repo == Repo.MODULAR_CANDIDATE:
         raise HTTPException(400, detail="modular subpackages cannot be built, build the main module")
 
-    extras = {}
+    extras = build_extras(body)
     token = None
 
-    if body.get("force_tag"):
-        extras["force_tag"] = body.get("force_tag")
-
     if body.get("scratch"):
-        extras["scratch"] = True
-
         latest_build = await Build.filter(package_id=package.id, status=BuildStatus.SUCCEEDED).prefetch_related(
             "import_commit").order_by(
             "-created_at").first()
@@ -127,39 +130,19 @@ async def queue_build(request: Request, body: Dict[str, BuildRequest], batch_bui
         latest_import = await Import.filter(**filters).order_by("-created_at").first()
         import_commits = await ImportCommit.filter(import__id=latest_import.id).all()
 
-    if body.get("arch_override"):
-        extras["arch_override"] = body.get("arch_override")
-
-    only_branch = body.get("only_branch")
-    for import_commit in import_commits:
-        if "-beta" not in import_commit.branch:
-            if only_branch and import_commit.branch != only_branch:
-                continue
-
-            stream_branch_prefix = f"{settings.original_import_branch_prefix}{settings.version}-stream"
-            if import_commit.branch.startswith(stream_branch_prefix):
-                if body.get("ignore_modules"):
-                    continue
-                if package.part_of_module and not package.is_module:
-                    continue
-                extras["mbs"] = True
-                if not token:
-                    token = request.session.get("token")
-
-            # temporarily skip containeronly streams
-            containeronly_stream_prefix = f"{settings.original_import_branch_prefix}{settings.version}-containeronly-stream"
-            if import_commit.branch.startswith(containeronly_stream_prefix):
-                continue
-
-            build = await Build.create(package_id=package.id, status=BuildStatus.QUEUED,
-                                       executor_username=user["preferred_username"],
-                                       point_release=f"{settings.version}_{settings.default_point_release}",
-                                       import_commit_id=import_commit.id, **extras)
-            if batch_build_id:
-                await BatchBuildPackage.create(build_id=build.id, batch_build_id=batch_build_id)
-            await build_package_task(package.id, build.id, token)
-
-            if only_branch:
-                break
+    for import_commit, mbs in select_build_commits(package, import_commits, body):
+        if mbs and not token:
+            token = request.session.get("token")
+
+        build = await Build.create(package_id=package.id, status=BuildStatus.QUEUED,
+                                   executor_username=user["preferred_username"],
+                                   point_release=f"{settings.version}_{settings.default_point_release}",
+                                   import_commit_id=import_commit.id, mbs=mbs, **extras)
+        if batch_build_id:
+            await BatchBuildPackage.create(build_id=build.id, batch_build_id=batch_build_id)
+        idempotency_key = build_idempotency_key(package.id, import_commit.id, build.scratch, build.arch_override,
+                                                build.force_tag)
+        await build_package_task(package.id, build.id, token, idempotency_key,
+                                 priority_for(batch_build_id is not None))
 
     return {}
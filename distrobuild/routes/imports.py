@@ -18,19 +18,24 @@
 #  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 #  SOFTWARE.
 
-from typing import Optional, Dict
+import asyncio
 
-from fastapi import APIRouter, Depends, HTTPException, Request
+from typing import Optional, Dict, AsyncIterator
+
+import aiofiles
+import aiofiles.os
+from fastapi import APIRouter, Depends, HTTPException, Request, Header
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi_pagination import pagination_params, Page
-from fastapi_pagination.ext.tortoise import paginate
 from pydantic import BaseModel, validator
 from starlette.responses import PlainTextResponse
 
 from distrobuild.common import gen_body_filters, create_import_order, get_user
+from distrobuild.common.pagination import CursorPage, CursorParams, cursor_params, paginate_cursor, paginate_values
 from distrobuild.models import Import, Package, Repo, ImportStatus
-from distrobuild.serialize import Import_Pydantic, ImportGeneral_Pydantic
+from distrobuild.serialize import Import_Pydantic, ImportListItem, import_list_items
 from distrobuild.settings import settings
-from distrobuild_scheduler import import_package_task
+from distrobuild_scheduler import import_package_task, priority_for
 
 router = APIRouter(prefix="/imports")
 
@@ -49,9 +54,16 @@ class ImportRequest(BaseModel):
         return package_name
 
 
-@router.get("/", response_model=Page[ImportGeneral_Pydantic], dependencies=[Depends(pagination_params)])
+@router.get("/", response_model=Page[ImportListItem], response_class=ORJSONResponse,
+            dependencies=[Depends(pagination_params)])
 async def list_imports():
-    return await paginate(Import.all().order_by("-created_at").prefetch_related("package", "commits"))
+    return ORJSONResponse(await paginate_values(Import.all().order_by("-created_at", "-id"), import_list_items))
+
+
+@router.get("/cursor/", response_model=CursorPage[ImportListItem], response_class=ORJSONResponse)
+async def list_imports_cursor(params: CursorParams = Depends(cursor_params)):
+    page = await paginate_cursor(Import.all(), [("created_at", True), ("id", True)], params, import_list_items)
+    return ORJSONResponse(dict(page))
 
 
 @router.get("/{import_id}", response_model=Import_Pydantic)
@@ -59,17 +71,90 @@ async def get_import(import_id: int):
     return await Import_Pydantic.from_queryset_single(Import.filter(id=import_id).prefetch_related("package").first())
 
 
+async def read_log(path: str, offset: int, end: int) -> AsyncIterator[bytes]:
+    async with aiofiles.open(path, "rb") as f:
+        await f.seek(offset)
+        remaining = end - offset
+        while remaining > 0:
+            chunk = await f.read(min(settings.import_logs_chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+# The event id is the offset after the event, EventSource sends it back as Last-Event-ID when it reconnects
+def log_event(data: bytes, offset: int, event: Optional[str] = None) -> str:
+    text = data.decode("utf-8", errors="replace")
+    if text.endswith("\n"):
+        text = text[:-1]
+
+    lines = [f"event: {event}"] if event else []
+    lines.append(f"id: {offset}")
+    lines += [f"data: {line}" for line in text.split("\n")]
+    return "\n".join(lines) + "\n\n"
+
+
+# Sends complete lines as they are written until the import finished and everything was sent
+async def follow_log(import_id: int, path: str, offset: int) -> AsyncIterator[str]:
+    async with aiofiles.open(path, "rb") as f:
+        await f.seek(offset)
+        pending = b""
+        finished = False
+        while True:
+            chunk = await f.read(settings.import_logs_chunk_size)
+            if chunk:
+                pending += chunk
+                lines_end = pending.rfind(b"\n") + 1
+                if lines_end > 0:
+                    offset += lines_end
+                    yield log_event(pending[:lines_end], offset)
+                    pending = pending[lines_end:]
+                continue
+
+            if finished:
+                if pending:
+                    offset += len(pending)
+                    yield log_event(pending, offset)
+                yield log_event(b"", offset, "end")
+                return
+
+            # srpmproc has exited and closed the log once the import isn't running anymore, one more read gets the rest
+            finished = not await Import.filter(id=import_id,
+                                               status__in=[ImportStatus.QUEUED, ImportStatus.IN_PROGRESS]).exists()
+            if not finished:
+                await asyncio.sleep(settings.import_logs_poll_interval)
+
+
+# offset is a byte offset into the log, negative offsets count from the end (tail).
+# X-Log-Offset is the offset to continue from, so pollers only fetch new bytes.
+# With follow the log is sent as server-sent events until the import finished.
 @router.get("/{import_id}/logs", response_class=PlainTextResponse)
-async def get_import_logs(import_id: int):
+async def get_import_logs(import_id: int, offset: int = 0, follow: bool = False,
+                          last_event_id: Optional[int] = Header(None)):
     import_obj = await Import.filter(id=import_id).get_or_none()
     if not import_obj:
         raise HTTPException(404, detail="import does not exist")
+
+    path = f"{settings.import_logs_dir}/import-{import_obj.id}.log"
     try:
-        with open(f"{settings.import_logs_dir}/import-{import_obj.id}.log") as f:
-            return f.read()
+        size = (await aiofiles.os.stat(path)).st_size
     except FileNotFoundError:
         raise HTTPException(412, detail="import not started or log has expired")
 
+    if last_event_id is not None:
+        offset = last_event_id
+    if offset < 0:
+        offset = max(size + offset, 0)
+    offset = min(offset, size)
+
+    if follow:
+        return StreamingResponse(follow_log(import_obj.id, path, offset), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    return StreamingResponse(read_log(path, offset, size), media_type="text/plain",
+                             headers={"X-Log-Offset": str(size)})
+
 
 @router.post("/{import_id}/cancel", status_code=202)
 async def cancel_import(request: Request, import_id: int):
@@ -97,8 +182,9 @@ async def import_package_route(request: Request, body: Dict[str, ImportRequest],
     if package.repo == Repo.MODULAR_CANDIDATE:
         raise HTTPException(401, detail="modular subpackages cannot be imported")
 
-    build_order = await create_import_order(package, user["preferred_username"], batch_import_id)
-    await import_package_task(build_order[0][0], build_order[0][1], build_order[1:],
-                              body.get("allow_stream_branches") or False)
+    ready_imports = await create_import_order(package, user["preferred_username"], batch_import_id)
+    for package_id, import_id, module in ready_imports:
+        await import_package_task(package_id, import_id, module, body.get("allow_stream_branches") or False,
+                                  priority_for(batch_import_id is not None))
 
     return {}
@@ -19,32 +19,207 @@
 #  SOFTWARE.
 import hashlib
 
-from fastapi import APIRouter, Request, File, UploadFile
+from typing import Optional, Tuple, AsyncIterator
+
+from fastapi import APIRouter, Request, Query, HTTPException, Response, Header, Path
+from fastapi.responses import StreamingResponse
+from multipart.multipart import MultipartParser, parse_options_header
 from pydantic import BaseModel
-from tortoise.transactions import atomic
+from starlette.concurrency import run_in_threadpool
+from tortoise.exceptions import IntegrityError
 
 from distrobuild.common import get_user
 from distrobuild.models import LookasideBlob
 from distrobuild.session import lookaside_session
+from distrobuild.settings import settings
 
 router = APIRouter(prefix="/lookaside")
 
+SHA256_REGEX = "^[0-9a-f]{64}$"
+
+
+class LookasideStatsResponse(BaseModel):
+    uploads: int
+    failed_uploads: int
+    in_flight: int
+    bytes: int
+    seconds: float
+    # bytes per second
+    throughput: float
+
 
 class LookasideUploadResponse(BaseModel):
     sha256sum: str
+    # the blob was already in the lookaside and hasn't been stored again
+    existing: bool = False
+
+
+@router.get("/stats", response_model=LookasideStatsResponse)
+async def lookaside_stats():
+    stats = lookaside_session.stats
+    return LookasideStatsResponse(uploads=stats.uploads, failed_uploads=stats.failed_uploads,
+                                  in_flight=stats.in_flight, bytes=stats.bytes, seconds=stats.seconds,
+                                  throughput=stats.throughput)
+
+
+# Parses a single byte range, returns None for a missing or multi-range header (the whole blob is sent then)
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+
+    start, _, end = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if not start:
+            # suffix range, the last n bytes
+            length = int(end)
+            if length <= 0:
+                raise ValueError()
+            return max(size - length, 0), size - 1
+
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    except ValueError:
+        raise HTTPException(416, detail="invalid range", headers={"Content-Range": f"bytes */{size}"})
+
+    if start >= size or start > end:
+        raise HTTPException(416, detail="range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+
+    return start, end
+
+
+# Streams one file of a multipart form straight from the request body in chunks of up to lookaside_chunk_size.
+# request.form() would spool the whole upload to a temporary file before it could be staged.
+async def form_file_chunks(request: Request, name: str) -> AsyncIterator[bytes]:
+    content_type, params = parse_options_header(request.headers.get("Content-Type", ""))
+    if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+        raise HTTPException(400, detail="expected a multipart/form-data upload")
+
+    # the parser reports everything through callbacks, they are collected and handled after every write
+    events = []
+    parser = MultipartParser(params[b"boundary"], {
+        "on_header_field": lambda data, start, end: events.append(("header_field", data[start:end])),
+        "on_header_value": lambda data, start, end: events.append(("header_value", data[start:end])),
+        "on_header_end": lambda: events.append(("header_end", b"")),
+        "on_headers_finished": lambda: events.append(("headers_finished", b"")),
+        "on_part_data": lambda data, start, end: events.append(("part_data", data[start:end])),
+        "on_part_end": lambda: events.append(("part_end", b"")),
+    })
 
+    found = False
+    in_file = False
+    header_field = b""
+    header_value = b""
+    disposition = b""
+    buffer = bytearray()
+    async for body in request.stream():
+        parser.write(body)
+        for event, data in events:
+            if event == "header_field":
+                header_field += data
+            elif event == "header_value":
+                header_value += data
+            elif event == "header_end":
+                if header_field.lower() == b"content-disposition":
+                    disposition = header_value
+                header_field = b""
+                header_value = b""
+            elif event == "headers_finished":
+                _, options = parse_options_header(disposition)
+                in_file = not found and options.get(b"name") == name.encode()
+                disposition = b""
+            elif event == "part_data" and in_file:
+                buffer += data
+            elif event == "part_end" and in_file:
+                found = True
+                in_file = False
+        events.clear()
 
-@atomic()
+        if len(buffer) >= settings.lookaside_chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+
+    parser.finalize()
+    if not found:
+        raise HTTPException(400, detail=f"{name} is required")
+    if buffer:
+        yield bytes(buffer)
+
+
+# Blobs never change, so they are served with their digest as ETag and can be cached forever
+@router.get("/{sha256sum}")
+async def get_lookaside_blob(sha256sum: str = Path(..., regex=SHA256_REGEX),
+                             range_header: Optional[str] = Header(None, alias="Range"),
+                             if_none_match: Optional[str] = Header(None)):
+    if not await LookasideBlob.exists(sum=sha256sum):
+        raise HTTPException(404, detail="blob does not exist")
+
+    headers = {
+        "ETag": f'"{sha256sum}"',
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes",
+    }
+    if if_none_match and sha256sum in if_none_match:
+        return Response(status_code=304, headers=headers)
+
+    size = await lookaside_session.size(sha256sum)
+    if size is None:
+        raise HTTPException(404, detail="blob is missing from storage")
+
+    status_code = 200
+    start, end = 0, size - 1
+    requested_range = parse_range(range_header, size)
+    if requested_range:
+        status_code = 206
+        start, end = requested_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    # an empty blob has nothing to read
+    body = lookaside_session.read(sha256sum, start, end) if size > 0 else iter([])
+    return StreamingResponse(body, status_code=status_code, headers=headers,
+                             media_type="application/octet-stream")
+
+
+@router.head("/{sha256sum}")
+async def lookaside_blob_exists(sha256sum: str = Path(..., regex=SHA256_REGEX)):
+    if not await LookasideBlob.exists(sum=sha256sum):
+        return Response(status_code=404)
+    return Response(status_code=200)
+
+
+# Clients that know the digest can pass it as sha256sum, the body isn't read at all if the blob already exists.
+# The upload is a multipart form with the blob in "file".
+# There is no transaction around the upload, it would stay open for as long as the body takes to arrive.
 @router.post("/", response_model=LookasideUploadResponse)
-async def put_file_in_lookaside(request: Request, file: UploadFile = File(...)):
+async def put_file_in_lookaside(request: Request, sha256sum: Optional[str] = Query(None, regex=SHA256_REGEX)):
     user = get_user(request)
 
-    file_content = await file.read()
-    await file.seek(0)
+    if sha256sum and await LookasideBlob.exists(sum=sha256sum):
+        return LookasideUploadResponse(sha256sum=sha256sum, existing=True)
+
+    # hash while staging the upload, only one chunk is held in memory at a time
+    sha256 = hashlib.sha256()
+    async with lookaside_session.staging_file() as staged:
+        async for chunk in form_file_chunks(request, "file"):
+            # hashlib releases the GIL for large buffers, hashing in the threadpool keeps the loop free
+            await run_in_threadpool(sha256.update, chunk)
+            await staged.write(chunk)
+
+        digest = sha256.hexdigest()
+        if sha256sum and digest != sha256sum:
+            raise HTTPException(400, detail=f"sha256sum mismatch, uploaded file has {digest}")
+
+        if await LookasideBlob.exists(sum=digest):
+            return LookasideUploadResponse(sha256sum=digest, existing=True)
 
-    sha256sum = hashlib.sha256(file_content).hexdigest()
-    lookaside_session.upload(file.file, sha256sum)
+        await lookaside_session.commit(staged, digest)
 
-    await LookasideBlob.create(sum=sha256sum, executor_username=user["preferred_username"])
+    try:
+        await LookasideBlob.create(sum=digest, executor_username=user["preferred_username"])
+    except IntegrityError:
+        # blobs are content addressed, a concurrent upload of the same file stored the same object
+        if not await LookasideBlob.exists(sum=digest):
+            raise
+        return LookasideUploadResponse(sha256sum=digest, existing=True)
 
-    return LookasideUploadResponse(sha256sum=sha256sum)
+    return LookasideUploadResponse(sha256sum=digest)
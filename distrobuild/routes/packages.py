@@ -25,6 +25,7 @@ from fastapi_pagination import Page, pagination_params
 from fastapi_pagination.ext.tortoise import paginate
 
 from distrobuild.common import get_user
+from distrobuild.common.pagination import CursorPage, CursorParams, cursor_params, paginate_cursor
 from distrobuild.models import Package, Repo, Build, BuildStatus
 from distrobuild.serialize import Package_Pydantic, PackageGeneral_Pydantic
 from distrobuild.session import koji_session
@@ -32,11 +33,10 @@ from distrobuild.session import koji_session
 router = APIRouter(prefix="/packages")
 
 
-@router.get("/", response_model=Page[PackageGeneral_Pydantic], dependencies=[Depends(pagination_params)])
-async def list_packages(name: Optional[str] = None, modules_only: bool = False, non_modules_only: bool = False,
-                        exclude_modular_candidates: bool = False, no_builds_only: bool = False,
-                        with_builds_only: bool = False, no_imports_only: bool = False, with_imports_only: bool = False,
-                        exclude_part_of_modules: bool = False):
+def package_filters(name: Optional[str] = None, modules_only: bool = False, non_modules_only: bool = False,
+                    exclude_modular_candidates: bool = False, no_builds_only: bool = False,
+                    with_builds_only: bool = False, no_imports_only: bool = False, with_imports_only: bool = False,
+                    exclude_part_of_modules: bool = False) -> dict:
     filters = {}
     if name:
         filters["name__icontains"] = name
@@ -57,9 +57,20 @@ async def list_packages(name: Optional[str] = None, modules_only: bool = False,
     if exclude_part_of_modules:
         filters["part_of_module"] = False
 
+    return filters
+
+
+@router.get("/", response_model=Page[PackageGeneral_Pydantic], dependencies=[Depends(pagination_params)])
+async def list_packages(filters: dict = Depends(package_filters)):
     return await paginate(Package.all().order_by("updated_at", "name").filter(**filters))
 
 
+@router.get("/cursor/", response_model=CursorPage[PackageGeneral_Pydantic])
+async def list_packages_cursor(filters: dict = Depends(package_filters), params: CursorParams = Depends(cursor_params)):
+    return await paginate_cursor(Package.filter(**filters), [("updated_at", False), ("name", False), ("id", False)],
+                                 params)
+
+
 @router.get("/{package_id}", response_model=Package_Pydantic)
 async def get_package(package_id: int):
     return await Package_Pydantic.from_queryset_single(
@@ -75,11 +86,11 @@ async def reset_latest_build_for_package(request: Request, package_id: int):
     if not latest_build:
         raise HTTPException(412, detail="no successful build found")
 
-    build_tasks = koji_session.listBuilds(taskID=latest_build.koji_id)
+    build_tasks = await koji_session.listBuilds(taskID=latest_build.koji_id)
     if len(build_tasks) == 0:
         raise HTTPException(412, detail="no build tasks found for latest build")
 
-    koji_session.resetBuild(build_tasks[0]["build_id"])
+    await koji_session.resetBuild(build_tasks[0]["build_id"])
 
     latest_build.status = BuildStatus.CANCELLED
     latest_build.executor_username = user["preferred_username"]
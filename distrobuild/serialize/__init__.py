@@ -18,9 +18,15 @@
 #  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 #  SOFTWARE.
 
+from datetime import datetime
+from typing import Optional, List, Dict
+
+from pydantic import BaseModel
 from tortoise.contrib.pydantic import pydantic_model_creator
+from tortoise.queryset import QuerySet, ValuesQuery
 
 from distrobuild import models
+from distrobuild.models import BuildStatus, ImportStatus, ImportCommit
 
 Package_Pydantic = pydantic_model_creator(models.Package, name="Package")
 PackageGeneral_Pydantic = pydantic_model_creator(models.Package, name="PackageGeneral", exclude=("imports", "builds"))
@@ -35,3 +41,87 @@ BatchImport_Pydantic = pydantic_model_creator(models.BatchImport, name="BatchImp
                                               exclude=("imports.package.imports", "imports.package.builds"))
 BatchBuild_Pydantic = pydantic_model_creator(models.BatchBuild, name="BatchBuild",
                                              exclude=("builds.package.imports", "builds.package.builds"))
+
+
+# Flat read models for the list endpoints. The rows are selected with .values() and joined in SQL,
+# the endpoints return them as they are with ORJSONResponse and the models only document the response.
+class PackageRef(BaseModel):
+    id: int
+    name: str
+
+
+class CommitRef(BaseModel):
+    id: int
+    commit: str
+    branch: str
+
+
+class BuildListItem(BaseModel):
+    id: int
+    created_at: datetime
+    updated_at: Optional[datetime]
+    status: BuildStatus
+    mbs: bool
+    signed: bool
+    scratch: bool
+    scratch_merged: bool
+    koji_id: Optional[int]
+    mbs_id: Optional[int]
+    executor_username: str
+    force_tag: Optional[str]
+    arch_override: Optional[str]
+    exclude_compose: bool
+    point_release: str
+    package: PackageRef
+    import_commit: CommitRef
+
+
+class ImportListItem(BaseModel):
+    id: int
+    created_at: datetime
+    updated_at: Optional[datetime]
+    status: ImportStatus
+    module: bool
+    version: int
+    executor_username: str
+    package: PackageRef
+    commits: List[CommitRef]
+
+
+def build_list_values(query: QuerySet) -> ValuesQuery:
+    return query.values("id", "created_at", "updated_at", "status", "mbs", "signed", "scratch", "scratch_merged",
+                        "koji_id", "mbs_id", "executor_username", "force_tag", "arch_override", "exclude_compose",
+                        "point_release", "package_id", "import_commit_id", package_name="package__name",
+                        commit="import_commit__commit", branch="import_commit__branch")
+
+
+async def build_list_items(query: QuerySet) -> List[dict]:
+    rows = await build_list_values(query)
+    for row in rows:
+        row["package"] = {"id": row.pop("package_id"), "name": row.pop("package_name")}
+        row["import_commit"] = {"id": row.pop("import_commit_id"), "commit": row.pop("commit"),
+                                "branch": row.pop("branch")}
+    return rows
+
+
+def import_list_values(query: QuerySet) -> ValuesQuery:
+    return query.values("id", "created_at", "updated_at", "status", "module", "version", "executor_username",
+                        "package_id", package_name="package__name")
+
+
+def import_commit_values(import_ids: List[int]) -> ValuesQuery:
+    return ImportCommit.filter(import__id__in=import_ids).order_by("id").values("id", "commit", "branch", "import__id")
+
+
+async def import_list_items(query: QuerySet) -> List[dict]:
+    rows = await import_list_values(query)
+
+    commits: Dict[int, List[dict]] = {}
+    if len(rows) > 0:
+        for commit in await import_commit_values([row["id"] for row in rows]):
+            commits.setdefault(commit.pop("import__id"), []).append(commit)
+
+    for row in rows:
+        row["package"] = {"id": row.pop("package_id"), "name": row.pop("package_name")}
+        row["commits"] = commits.get(row["id"], [])
+    return rows
@@ -21,17 +21,22 @@
 import gitlab
 import koji
 from cryptography.fernet import Fernet
-from koji_cli.lib import activate_session
 
+from distrobuild.aiokoji import AsyncKojiSession
 from distrobuild.lookaside import Lookaside
+from distrobuild.lookaside.cache import LookasideCache
 from distrobuild.mbs import MBSClient
 from distrobuild.settings import settings
 
 gl = gitlab.Gitlab(f"https://{settings.gitlab_host}", private_token=settings.gitlab_api_key)
 
 koji_config = koji.read_config("koji")
-koji_session = koji.ClientSession(koji_config["server"], koji_config)
-activate_session(koji_session, koji_config)
-mbs_client = MBSClient(settings.mbs_url)
+koji_session = AsyncKojiSession(koji_config, settings.koji_pool_size, settings.koji_multicall_batch)
+mbs_client = MBSClient(settings.mbs_url, timeout=settings.mbs_timeout, max_connections=settings.mbs_max_connections,
+                       retries=settings.mbs_retries, cache_ttl=settings.mbs_cache_ttl)
 message_cipher = Fernet(settings.message_secret)
-lookaside_session = Lookaside(settings.storage_addr)
+lookaside_cache = None
+if settings.lookaside_cache_dir:
+    lookaside_cache = LookasideCache(settings.lookaside_cache_dir, settings.lookaside_cache_size)
+lookaside_session = Lookaside(settings.storage_addr, settings.lookaside_chunk_size, settings.lookaside_staging_dir,
+                              settings.lookaside_max_concurrency, lookaside_cache)
@@ -46,12 +46,34 @@ class Settings(BaseSettings):
     no_storage_download: bool = False
     no_storage_upload: bool = False
     import_logs_dir: str = "/tmp"
+    import_logs_chunk_size: int = 64 * 1024
+    # how often followed logs are checked for new output
+    import_logs_poll_interval: float = 1
     original_import_branch_prefix: str = "r"
     original_rpm_prefix: str = "https://git.rockylinux.org/staging/src"
     original_module_prefix: str = "https://git.rockylinux.org/original/modules"
 
+    # koji
+    koji_pool_size: int = 10
+    koji_multicall_batch: int = 500
+
     # mbs
     mbs_url: str
+    mbs_timeout: float = 30
+    mbs_max_connections: int = 20
+    mbs_retries: int = 3
+    mbs_cache_ttl: float = 30
+
+    # lookaside
+    # uploads are hashed and written in chunks of this size, also the multipart/resumable part size
+    lookaside_chunk_size: int = 8 * 1024 * 1024
+    # uploads are staged here until their digest is known, defaults to the system temp dir
+    lookaside_staging_dir: Optional[str]
+    # uploads sent to the storage backend at once
+    lookaside_max_concurrency: int = 4
+    # local LRU cache in front of S3/GCS for blobs served by the API, disabled without a directory
+    lookaside_cache_dir: Optional[str]
+    lookaside_cache_size: int = 10 * 1024 * 1024 * 1024
 
     # sigul
     disable_sigul: bool = False
@@ -59,6 +81,13 @@ class Settings(BaseSettings):
     sigul_passphrase: str
     sigul_key_name: str = "signing"
     sigul_key_id: str
+    sigul_concurrency: int = 4
+    sigul_write_concurrency: int = 4
+    # signatures per second and key, 0 disables the limit
+    sigul_rate_limit: float = 0
+    sigul_queue_size: int = 100
+    signature_cache_ttl: int = 60 * 60 * 24
+    signature_cache_size: int = 100000
 
     # oidc
     oidc_issuer: str
@@ -73,7 +102,34 @@ class Settings(BaseSettings):
     # scheduler options
     broker_url: str
     routing_key: str = "distrobuild"
-    workers: int = 10
+    import_workers: int = 10
+    import_prefetch: int = 1
+    build_workers: int = 10
+    build_prefetch: int = 1
+    merge_scratch_workers: int = 2
+    merge_scratch_prefetch: int = 1
+    expand_batch_workers: int = 2
+    expand_batch_prefetch: int = 1
+    queue_stats_interval: int = 60
+    # between 0 and 10
+    interactive_priority: int = 8
+    batch_priority: int = 2
+    dedup_ttl: int = 60 * 60 * 6
+    build_status_poll_interval: int = 60 * 5
+    # builds handled at once by the periodic tasks, keep below the database pool size
+    periodic_concurrency: int = 4
+    periodic_cycle_deadline: int = 60 * 15
+    # messages of a batch in flight at once, the broker confirms them in parallel
+    batch_publish_concurrency: int = 200
+    # requested packages expanded per transaction when a batch is submitted in the background
+    batch_expand_chunk: int = 250
+
+    # build events
+    build_event_source: Optional[str]
+    build_events_exchange: str = "amq.topic"
+    build_events_koji_topic: str = "org.rockylinux.buildsys.task.state.change"
+    build_events_mbs_topic: str = "org.rockylinux.mbs.module.state.change"
+    build_status_reconcile_interval: int = 60 * 30
 
     class Config:
         env_file = "/etc/distrobuild/settings"
@@ -85,7 +85,9 @@ async def import_project(import_id: int, source_rpm: str, module_mode: bool = Fa
     args.append("--module-prefix")
     args.append("https://git.rockylinux.org/staging/src-rhel/modules")
 
-    f = open(f"{settings.import_logs_dir}/import-{import_id}.log", "w")
+    # stdout is copied in line by line while srpmproc writes stderr to the file directly,
+    # line buffering keeps both in order and visible to followers of the log right away
+    f = open(f"{settings.import_logs_dir}/import-{import_id}.log", "w", buffering=1)
 
     proc = await asyncio.create_subprocess_exec("srpmproc", *args, stdout=asyncio.subprocess.PIPE, stderr=f)
 
@@ -21,15 +21,17 @@
 import json
 import logging
 
-from typing import Tuple, Optional, List
+from typing import Optional
 
 import aio_pika
+import aioredis
 
 from distrobuild.settings import settings
 
 # singleton
 connection: Optional[aio_pika.RobustConnection] = None
 channel: Optional[aio_pika.Channel] = None
+redis: Optional[aioredis.Redis] = None
 logger = logging.getLogger("distrobuild_scheduler")
 logging.basicConfig()
 
@@ -38,6 +40,32 @@ if settings.debug:
 else:
     logger.setLevel(logging.INFO)
 
+IMPORT_PACKAGE = "import_package"
+BUILD_PACKAGE = "build_package"
+MERGE_SCRATCH = "merge_scratch"
+EXPAND_BATCH = "expand_batch"
+
+# every message type gets its own queue, so long imports can't starve builds
+MESSAGE_TYPES = (IMPORT_PACKAGE, BUILD_PACKAGE, MERGE_SCRATCH, EXPAND_BATCH)
+
+BATCH_IMPORT = "import"
+BATCH_BUILD = "build"
+
+QUEUE_STATS_KEY = "distrobuild_scheduler:queue_stats"
+
+# queues are priority queues, messages with a higher priority are delivered first.
+# work somebody is waiting on is published with interactive_priority, batches with batch_priority
+MAX_PRIORITY = 10
+
+
+def queue_name(message_type: str) -> str:
+    return f"{settings.routing_key}.{message_type}"
+
+
+async def declare_queue(declare_channel: aio_pika.Channel, message_type: str) -> aio_pika.Queue:
+    return await declare_channel.declare_queue(queue_name(message_type), auto_delete=False,
+                                               arguments={"x-max-priority": MAX_PRIORITY})
+
 
 async def init_channel(loop) -> None:
     global channel
@@ -46,53 +74,79 @@ async def init_channel(loop) -> None:
     logger.info("[*] Connected to amqp")
     channel = await connection.channel()
 
+    # messages published to a queue that doesn't exist yet would be dropped
+    for message_type in MESSAGE_TYPES:
+        await declare_queue(channel, message_type)
 
-async def import_package_task(package_id: int, import_id: int, dependents: List[Tuple[int, int]],
-                              allow_stream_branches: bool = False):
-    msg_body = {
-        "message": "import_package",
-        "package_id": package_id,
-        "import_id": import_id,
-        "allow_stream_branches": allow_stream_branches,
-        "dependents": dependents,
-    }
-    encoded = json.dumps(msg_body).encode()
+
+async def init_redis() -> None:
+    global redis
+    redis = await aioredis.create_redis_pool(settings.redis_url)
+
+
+async def close_redis() -> None:
+    if redis:
+        redis.close()
+        await redis.wait_closed()
+
+
+def priority_for(batch: bool) -> int:
+    return settings.batch_priority if batch else settings.interactive_priority
+
+
+# consumers drop messages whose key is held by another import/build that is still queued or running
+def import_idempotency_key(package_id: int, module: bool) -> str:
+    return f"{IMPORT_PACKAGE}:{package_id}:{int(module)}"
+
+
+def build_idempotency_key(package_id: int, import_commit_id: int, scratch: bool, arch_override: Optional[str],
+                          force_tag: Optional[str]) -> str:
+    return f"{BUILD_PACKAGE}:{package_id}:{import_commit_id}:{int(scratch)}:{arch_override or ''}:{force_tag or ''}"
+
+
+async def publish(message_type: str, msg_body: dict, priority: int, idempotency_key: Optional[str] = None):
+    encoded = json.dumps(dict(message=message_type, priority=priority, idempotency_key=idempotency_key,
+                              **msg_body)).encode()
 
     await channel.default_exchange.publish(
         aio_pika.Message(
             body=encoded,
+            priority=priority,
+            message_id=idempotency_key,
         ),
-        routing_key=settings.routing_key,
+        routing_key=queue_name(message_type),
     )
 
 
-async def build_package_task(package_id: int, build_id: int, token: Optional[str]):
-    msg_body = {
-        "message": "build_package",
+async def import_package_task(package_id: int, import_id: int, module: bool, allow_stream_branches: bool = False,
+                              priority: int = settings.interactive_priority):
+    await publish(IMPORT_PACKAGE, {
+        "package_id": package_id,
+        "import_id": import_id,
+        "allow_stream_branches": allow_stream_branches,
+    }, priority, import_idempotency_key(package_id, module))
+
+
+async def build_package_task(package_id: int, build_id: int, token: Optional[str], idempotency_key: str,
+                             priority: int = settings.interactive_priority):
+    await publish(BUILD_PACKAGE, {
         "package_id": package_id,
         "build_id": build_id,
         "token": token,
-    }
-    encoded = json.dumps(msg_body).encode()
-
-    await channel.default_exchange.publish(
-        aio_pika.Message(
-            body=encoded,
-        ),
-        routing_key=settings.routing_key,
-    )
+    }, priority, idempotency_key)
 
 
-async def merge_scratch_task(build_id: int):
-    msg_body = {
-        "message": "merge_scratch",
+async def merge_scratch_task(build_id: int, priority: int = settings.interactive_priority):
+    await publish(MERGE_SCRATCH, {
         "build_id": build_id,
-    }
-    encoded = json.dumps(msg_body).encode()
+    }, priority)
 
-    await channel.default_exchange.publish(
-        aio_pika.Message(
-            body=encoded,
-        ),
-        routing_key=settings.routing_key,
-    )
+
+# token is the encrypted session token, it's only handed on to the build messages of the batch
+async def expand_batch_task(batch_type: str, batch_id: int, priority: int = settings.interactive_priority,
+                            token: Optional[str] = None):
+    await publish(EXPAND_BATCH, {
+        "batch_type": batch_type,
+        "batch_id": batch_id,
+        "token": token,
+    }, priority, f"{EXPAND_BATCH}:{batch_type}:{batch_id}")
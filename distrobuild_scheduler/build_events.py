@@ -0,0 +1,165 @@
+#  Copyright (c) 2021 The Distrobuild Authors
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+import asyncio
+import json
+import sys
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+import aio_pika
+
+from distrobuild.models import Build, BuildStatus
+from distrobuild.session import mbs_client
+from distrobuild.settings import settings
+from distrobuild_scheduler import logger
+from distrobuild_scheduler.periodic_tasks import atomic_check_build_status
+
+KOJI = "koji"
+MBS = "mbs"
+
+KOJI_FINAL_STATES = ("CLOSED", "CANCELED", "FAILED")
+MBS_FINAL_STATES = ("ready", "failed")
+
+
+@dataclass
+class BuildEvent:
+    kind: str
+    id: int
+    state: str
+
+
+class BuildEventSource(ABC):
+    @abstractmethod
+    async def listen(self, handler: Callable[[BuildEvent], Awaitable[None]]):
+        pass
+
+
+# Listens for fedora-messaging style koji/mbs state change messages on the scheduler's amqp connection
+class AmqpBuildEventSource(BuildEventSource):
+    async def listen(self, handler: Callable[[BuildEvent], Awaitable[None]]):
+        from distrobuild_scheduler import connection
+
+        channel = await connection.channel()
+        exchange = await channel.declare_exchange(settings.build_events_exchange, aio_pika.ExchangeType.TOPIC,
+                                                  durable=True)
+        queue = await channel.declare_queue(f"{settings.routing_key}.build_events", auto_delete=False)
+        await queue.bind(exchange, settings.build_events_koji_topic)
+        await queue.bind(exchange, settings.build_events_mbs_topic)
+
+        async with queue.iterator() as queue_iter:
+            logger.info("[*] Waiting for build events")
+            async for message in queue_iter:
+                async with message.process():
+                    try:
+                        event = parse_event(message.routing_key, json.loads(message.body.decode()))
+                    except (ValueError, KeyError) as e:
+                        logger.error(f"build_events: invalid message: {e}")
+                        continue
+
+                    if event:
+                        await handler(event)
+
+
+sources = {
+    "amqp": AmqpBuildEventSource,
+}
+
+
+def create_source(name: str) -> BuildEventSource:
+    if name not in sources:
+        raise ValueError(f"unknown build event source {name}, available: {', '.join(sources.keys())}")
+    return sources[name]()
+
+
+def parse_event(topic: str, body: dict):
+    if topic == settings.build_events_koji_topic:
+        return BuildEvent(kind=KOJI, id=int(body["id"]), state=body["new"])
+    elif topic == settings.build_events_mbs_topic:
+        return BuildEvent(kind=MBS, id=int(body["id"]), state=body["state_name"])
+
+    return None
+
+
+async def handle_build_event(event: BuildEvent):
+    if event.kind == KOJI and event.state in KOJI_FINAL_STATES:
+        builds = await Build.filter(koji_id=event.id, status=BuildStatus.BUILDING).all()
+    elif event.kind == MBS and event.state in MBS_FINAL_STATES:
+        mbs_client.invalidate(event.id)
+        builds = await Build.filter(mbs_id=event.id, status=BuildStatus.BUILDING).all()
+    else:
+        return
+
+    # the event only tells us to look now, the hub stays the source of truth
+    for build in builds:
+        logger.debug(f"[*] {event.kind} {event.id} is {event.state}, checking build {build.id}")
+        try:
+            await atomic_check_build_status(build)
+        except Exception as e:
+            logger.error(f"handle_build_event: {e}")
+
+
+async def listen_for_build_events(source: BuildEventSource):
+    while True:
+        try:
+            await source.listen(handle_build_event)
+        except Exception as e:
+            logger.error(f"listen_for_build_events: {e}")
+            await asyncio.sleep(10)
+
+
+# Stand-in for the koji/mbs message publishers, used to exercise the event path locally
+async def publish_build_event(kind: str, build_id: int, state: str):
+    from distrobuild_scheduler import connection
+
+    if kind == KOJI:
+        topic = settings.build_events_koji_topic
+        body = {"id": build_id, "new": state}
+    elif kind == MBS:
+        topic = settings.build_events_mbs_topic
+        body = {"id": build_id, "state_name": state}
+    else:
+        raise ValueError(f"unknown build event kind {kind}")
+
+    channel = await connection.channel()
+    exchange = await channel.declare_exchange(settings.build_events_exchange, aio_pika.ExchangeType.TOPIC,
+                                              durable=True)
+    await exchange.publish(aio_pika.Message(body=json.dumps(body).encode()), routing_key=topic)
+    await channel.close()
+
+
+async def _publish_main(loop, kind: str, build_id: int, state: str):
+    from distrobuild_scheduler import init_channel
+
+    await init_channel(loop)
+    from distrobuild_scheduler import connection
+    try:
+        await publish_build_event(kind, build_id, state)
+    finally:
+        await connection.close()
+
+
+# usage: python3 -m distrobuild_scheduler.build_events {koji,mbs} ID STATE
+if __name__ == "__main__":
+    main_loop = asyncio.new_event_loop()
+    main_loop.run_until_complete(_publish_main(main_loop, sys.argv[1], int(sys.argv[2]), sys.argv[3]))
+    main_loop.close()
@@ -28,7 +28,7 @@ from distrobuild.mbs import MBSConflictException
 from distrobuild.models import Build, BuildStatus, Package, Repo
 from distrobuild.session import koji_session, mbs_client
 from distrobuild.settings import settings
-from distrobuild_scheduler import logger
+from distrobuild_scheduler import logger, dedup
 
 from distrobuild_scheduler.utils import gitlabify
 
@@ -59,7 +59,7 @@ async def do(package: Package, build: Build, token: Optional[str]):
             if build.arch_override:
                 opts["arch_override"] = koji.parse_arches(build.arch_override)
 
-            task_id = koji_session.build(source, target, opts)
+            task_id = await koji_session.build(source, target, opts)
 
             build.koji_id = task_id
             build.status = BuildStatus.BUILDING
@@ -72,12 +72,22 @@ async def do(package: Package, build: Build, token: Optional[str]):
 
 
 # noinspection DuplicatedCode
-async def task(package_id: int, build_id: int, token: Optional[str]):
+async def task(package_id: int, build_id: int, token: Optional[str], idempotency_key: Optional[str] = None):
     build = await Build.filter(id=build_id).prefetch_related("import_commit").get()
 
     if build.status == BuildStatus.CANCELLED:
         return
 
+    if idempotency_key:
+        owner_build_id = await dedup.claim(idempotency_key, build.id)
+        if owner_build_id:
+            if await Build.filter(id=owner_build_id, status__in=[BuildStatus.QUEUED, BuildStatus.BUILDING]).exists():
+                logger.info(f"[*] build {build.id} duplicates build {owner_build_id}, dropping")
+                build.status = BuildStatus.CANCELLED
+                await build.save()
+                return
+            await dedup.take_over(idempotency_key, build.id)
+
     package = await Package.filter(id=package_id).get()
     try:
         await do(package, build, token)
@@ -0,0 +1,48 @@
+#  Copyright (c) 2021 The Distrobuild Authors
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+from typing import Optional
+
+from distrobuild.settings import settings
+
+DEDUP_PREFIX = "distrobuild_scheduler:dedup:"
+
+
+# Claims idempotency_key for owner_id (a build or import id) for dedup_ttl seconds.
+# Returns the id of the current owner if somebody else holds the key.
+async def claim(idempotency_key: str, owner_id: int) -> Optional[int]:
+    from distrobuild_scheduler import redis
+
+    key = f"{DEDUP_PREFIX}{idempotency_key}"
+    if await redis.set(key, str(owner_id), expire=settings.dedup_ttl, exist=redis.SET_IF_NOT_EXIST):
+        return None
+
+    existing = await redis.get(key, encoding="utf-8")
+    if existing is None or int(existing) == owner_id:
+        await take_over(idempotency_key, owner_id)
+        return None
+
+    return int(existing)
+
+
+async def take_over(idempotency_key: str, owner_id: int):
+    from distrobuild_scheduler import redis
+
+    await redis.set(f"{DEDUP_PREFIX}{idempotency_key}", str(owner_id), expire=settings.dedup_ttl)
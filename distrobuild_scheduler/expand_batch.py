@@ -0,0 +1,138 @@
+#  Copyright (c) 2021 The Distrobuild Authors
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+from typing import List, Optional
+
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.transactions import in_transaction
+
+from distrobuild.common.bulk import resolve_packages, bulk_import_packages, bulk_queue_builds, publish_batch, \
+    import_tasks, build_tasks, BatchTask
+from distrobuild.models import BatchImport, BatchBuild, Import, ImportStatus, Build, BuildStatus
+from distrobuild.settings import settings
+from distrobuild_scheduler import logger, BATCH_IMPORT
+
+
+def batch_members(batch_type: str, batch_id: int, connection: Optional[BaseDBAsyncClient] = None):
+    if batch_type == BATCH_IMPORT:
+        return Import.filter(batch_imports__id=batch_id).using_db(connection)
+    return Build.filter(batch_builds__id=batch_id).using_db(connection)
+
+
+async def last_member_id(batch_type: str, batch_id: int, connection: BaseDBAsyncClient) -> int:
+    member = await batch_members(batch_type, batch_id, connection).order_by("-id").only("id").first()
+    return member.id if member else 0
+
+
+# Messages for the members written after `outbox`. Member ids come from the table's sequence and chunks
+# are written one after another, so those are exactly the members of the last chunk.
+# Members that already left the queued state were published before and are skipped.
+async def outbox_tasks(batch_type: str, batch_id: int, request: dict, outbox: int,
+                       token: Optional[str]) -> List[BatchTask]:
+    members = batch_members(batch_type, batch_id).filter(id__gt=outbox)
+    if batch_type == BATCH_IMPORT:
+        return import_tasks(await members.filter(status=ImportStatus.QUEUED).all(), request["allow_stream_branches"])
+    return build_tasks(await members.filter(status=BuildStatus.QUEUED).all(), token)
+
+
+# Expands one chunk of the batch, starting where the last chunk stopped.
+# The batch row stays locked until the chunk is written, so a redelivered message can't expand a chunk twice.
+# The chunk is only marked as published once its messages went out, a chunk that was written but never
+# published (the scheduler died in between) is published again by the next pass instead of expanding further.
+# Returns False once every package has been expanded.
+async def expand_chunk(batch_type: str, batch_id: int, token: Optional[str]) -> bool:
+    batch_model = BatchImport if batch_type == BATCH_IMPORT else BatchBuild
+
+    async with in_transaction() as connection:
+        batch = await batch_model.filter(id=batch_id).select_for_update().using_db(connection).get_or_none()
+        if not batch or not batch.request:
+            return False
+
+        if "outbox" not in batch.request:
+            requests = batch.request["packages"]
+            if batch.expanded >= len(requests):
+                batch.request = None
+                await batch.save(using_db=connection, update_fields=["request"])
+                return False
+
+            chunk = requests[batch.expanded:batch.expanded + settings.batch_expand_chunk]
+            packages, missing = await resolve_packages(chunk)
+            if len(missing) > 0:
+                logger.info(f"[*] Batch {batch_type} {batch_id}: packages do not exist: {', '.join(missing)}")
+
+            batch.request["outbox"] = await last_member_id(batch_type, batch_id, connection)
+            username = batch.request["username"]
+            if batch_type == BATCH_IMPORT:
+                await bulk_import_packages(batch.id, packages, username, batch.request["allow_stream_branches"],
+                                           len(missing))
+            else:
+                await bulk_queue_builds(batch.id, packages, username, token, batch.request["options"],
+                                        len(missing))
+            await batch.save(using_db=connection, update_fields=["request"])
+        else:
+            logger.info(f"[*] Batch {batch_type} {batch_id}: publishing the last chunk again")
+
+        request = batch.request
+
+    await publish_batch(batch_model, batch_id, await outbox_tasks(batch_type, batch_id, request,
+                                                                  request["outbox"], token))
+
+    async with in_transaction() as connection:
+        batch = await batch_model.filter(id=batch_id).select_for_update().using_db(connection).get()
+        batch.request.pop("outbox", None)
+        await batch.save(using_db=connection, update_fields=["request"])
+
+    return True
+
+
+# Gives up on the rest of a batch. Packages that weren't expanded yet and members of a chunk
+# that was never published count as failed.
+async def fail_batch(batch_type: str, batch_id: int):
+    batch_model = BatchImport if batch_type == BATCH_IMPORT else BatchBuild
+
+    async with in_transaction() as connection:
+        batch = await batch_model.filter(id=batch_id).select_for_update().using_db(connection).get_or_none()
+        if not batch or not batch.request:
+            return
+
+        failed = 0
+        if "outbox" in batch.request:
+            members = batch_members(batch_type, batch_id, connection).filter(id__gt=batch.request["outbox"])
+            if batch_type == BATCH_IMPORT:
+                ids = await members.filter(status=ImportStatus.QUEUED).values_list("id", flat=True)
+                failed = await Import.filter(id__in=ids).using_db(connection).update(status=ImportStatus.FAILED)
+            else:
+                ids = await members.filter(status=BuildStatus.QUEUED).values_list("id", flat=True)
+                failed = await Build.filter(id__in=ids).using_db(connection).update(status=BuildStatus.FAILED)
+
+        remaining = max(len(batch.request["packages"]) - batch.expanded, 0)
+        batch.request = None
+        batch.expanded += remaining
+        batch.failed += remaining + failed
+        await batch.save(using_db=connection, update_fields=["request", "expanded", "failed"])
+
+
+async def task(batch_type: str, batch_id: int, token: Optional[str] = None):
+    try:
+        while await expand_chunk(batch_type, batch_id, token):
+            pass
+    except Exception as e:
+        logger.error(f"expand_batch: {batch_type} {batch_id}: {e}")
+        await fail_batch(batch_type, batch_id)
@@ -20,8 +20,9 @@
 
 import datetime
 
-from typing import List, Tuple
+from typing import List, Tuple, Optional
 
+from tortoise.expressions import F
 from tortoise.transactions import atomic
 
 from distrobuild.common import tags
@@ -29,14 +30,14 @@ from distrobuild.models import ImportStatus, Package, Import, ImportCommit, Repo
 from distrobuild.session import koji_session, gl
 from distrobuild.settings import settings
 from distrobuild import srpmproc
-from distrobuild_scheduler import logger
+from distrobuild_scheduler import logger, import_package_task, dedup
 
 from distrobuild_scheduler.utils import gitlabify
 
 
 @atomic()
 async def do(package: Package, package_import: Import, allow_stream_branches: bool):
-    koji_session.packageListAdd(tags.base(), package.name, "distrobuild")
+    await koji_session.packageListAdd(tags.base(), package.name, "distrobuild")
 
     original = package.repo == Repo.ORIGINAL
     branch_commits_and_versions = await srpmproc.import_project(package_import.id, package.name, package_import.module,
@@ -55,26 +56,103 @@ async def do(package: Package, package_import: Import, allow_stream_branches: bo
     project.save()
 
 
+# Stores the status the import ended with and marks it as done on its parent. Both happen in one transaction
+# and released is only set once, so a redelivered message can't count the import off the parent twice.
+@atomic()
+async def finish(package_import: Import):
+    # the lock also keeps a dropped duplicate from handing over its parent while this one finishes
+    current = await Import.filter(id=package_import.id).select_for_update().get()
+    package_import.parent_import_id = current.parent_import_id
+    package_import.released = current.released
+
+    if package_import.parent_import_id and not package_import.released:
+        await Import.filter(id=package_import.parent_import_id).select_for_update().get()
+        await Import.filter(id=package_import.parent_import_id).update(
+            pending_dependencies=F("pending_dependencies") - 1)
+        package_import.released = True
+
+    await package_import.save(update_fields=["status", "released"])
+
+
+# The parent is published once nothing is pending anymore and as long as it hasn't run yet. A message that is
+# redelivered after the parent was published may publish it again, the copy is dropped once the parent finished.
+async def publish_parent(parent_import_id: int, allow_stream_branches: bool, priority: int):
+    parent_import = await Import.filter(id=parent_import_id).get()
+    if parent_import.pending_dependencies == 0 and parent_import.status == ImportStatus.QUEUED:
+        await import_package_task(parent_import.package_id, parent_import.id, parent_import.module,
+                                  allow_stream_branches, priority)
+
+
+# Messages published before imports were linked through parent_import_id carry the rest of
+# their chain in `dependents`. Store that chain as links so every step runs as its own message.
+@atomic()
+async def persist_chain(import_id: int, dependents: List[Tuple[int, int]]):
+    chain = [import_id] + [dependent_import_id for _, dependent_import_id in dependents]
+    for previous_import_id, next_import_id in zip(chain, chain[1:]):
+        await Import.filter(id=previous_import_id).update(parent_import_id=next_import_id)
+        await Import.filter(id=next_import_id).update(pending_dependencies=1)
+
+
+# Drops package_import in favour of the running import that owns its idempotency key. A parent
+# waiting on the duplicate is handed over to the owner, which releases it once it's done. Returns
+# False if the owner already finished or is linked to another parent, the duplicate has to run then.
+@atomic()
+async def drop_duplicate(package_import: Import, owner_import_id: int) -> bool:
+    owner_import = await Import.filter(id=owner_import_id).select_for_update().get_or_none()
+    if not owner_import or owner_import.status not in [ImportStatus.QUEUED, ImportStatus.IN_PROGRESS]:
+        return False
+
+    if package_import.parent_import_id:
+        if owner_import.parent_import_id:
+            return False
+        owner_import.parent_import_id = package_import.parent_import_id
+        await owner_import.save(update_fields=["parent_import_id"])
+        package_import.parent_import_id = None
+
+    package_import.status = ImportStatus.CANCELLED
+    await package_import.save(update_fields=["status", "parent_import_id"])
+    return True
+
+
 # noinspection DuplicatedCode
-async def task(package_id: int, import_id: int, dependents: List[Tuple[int, int]], allow_stream_branches: bool = False):
+async def task(package_id: int, import_id: int, allow_stream_branches: bool = False,
+               dependents: Optional[List[Tuple[int, int]]] = None, priority: int = settings.interactive_priority,
+               idempotency_key: Optional[str] = None):
+    if dependents:
+        await persist_chain(import_id, dependents)
+
     package = await Package.filter(id=package_id).get()
     package_import = await Import.filter(id=import_id).get()
 
-    if package_import.status != ImportStatus.CANCELLED:
-        try:
-            package_import.status = ImportStatus.IN_PROGRESS
-            await package_import.save()
-
-            await do(package, package_import, allow_stream_branches)
-        except Exception as e:
-            logger.error(e)
-            package_import.status = ImportStatus.FAILED
-            package.last_import = None
-        else:
-            package_import.status = ImportStatus.SUCCEEDED
-        finally:
-            await package_import.save()
-            await package.save()
-
-    if len(dependents) > 0:
-        await task(dependents[0][0], dependents[0][1], dependents[1:])
+    if package_import.status in [ImportStatus.SUCCEEDED, ImportStatus.FAILED]:
+        # redelivered after the import finished, at most the parent is left to release
+        logger.info(f"[*] import {package_import.id} already finished, not running it again")
+    else:
+        if idempotency_key and package_import.status != ImportStatus.CANCELLED:
+            owner_import_id = await dedup.claim(idempotency_key, package_import.id)
+            if owner_import_id:
+                if await drop_duplicate(package_import, owner_import_id):
+                    logger.info(f"[*] import {package_import.id} duplicates import {owner_import_id}, dropping")
+                else:
+                    await dedup.take_over(idempotency_key, package_import.id)
+
+        # only status is written while the import runs, a dropped duplicate may hand its parent to this one meanwhile
+        if package_import.status != ImportStatus.CANCELLED:
+            try:
+                package_import.status = ImportStatus.IN_PROGRESS
+                await package_import.save(update_fields=["status"])
+
+                await do(package, package_import, allow_stream_branches)
+            except Exception as e:
+                logger.error(e)
+                package_import.status = ImportStatus.FAILED
+                package.last_import = None
+            else:
+                package_import.status = ImportStatus.SUCCEEDED
+            finally:
+                await package.save()
+
+    await finish(package_import)
+
+    if package_import.parent_import_id:
+        await publish_parent(package_import.parent_import_id, allow_stream_branches, priority)
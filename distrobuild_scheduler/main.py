@@ -21,6 +21,8 @@
 import asyncio
 import json
 
+from typing import Optional
+
 from tortoise import Tortoise
 
 from distrobuild_scheduler.sigul import check_sigul_key
@@ -29,55 +31,129 @@ Tortoise.init_models(["distrobuild.models"], "distrobuild")
 
 from distrobuild.settings import TORTOISE_ORM, settings
 
-from distrobuild.session import message_cipher
+from distrobuild.session import message_cipher, koji_session, mbs_client
 
 # noinspection PyUnresolvedReferences
-from distrobuild_scheduler import init_channel, build_package, import_package, logger, periodic_tasks, merge_scratch
-
+from distrobuild_scheduler import init_channel, init_redis, close_redis, build_package, import_package, logger, \
+    periodic_tasks, merge_scratch, build_events, expand_batch, declare_queue, queue_name, IMPORT_PACKAGE, \
+    BUILD_PACKAGE, MERGE_SCRATCH, EXPAND_BATCH, MESSAGE_TYPES, QUEUE_STATS_KEY
+
+# message type -> (workers, prefetch count per worker)
+worker_pools = {
+    IMPORT_PACKAGE: (settings.import_workers, settings.import_prefetch),
+    BUILD_PACKAGE: (settings.build_workers, settings.build_prefetch),
+    MERGE_SCRATCH: (settings.merge_scratch_workers, settings.merge_scratch_prefetch),
+    EXPAND_BATCH: (settings.expand_batch_workers, settings.expand_batch_prefetch),
+}
+busy_workers = {message_type: 0 for message_type in MESSAGE_TYPES}
+
+
+async def handle_message(body: dict):
+    msg = body.get("message")
+
+    if msg == IMPORT_PACKAGE:
+        await import_package.task(body["package_id"], body["import_id"], body["allow_stream_branches"],
+                                  body.get("dependents"), body.get("priority", settings.interactive_priority),
+                                  body.get("idempotency_key"))
+    elif msg == BUILD_PACKAGE:
+        token = body.get("token")
+        if token:
+            token = message_cipher.decrypt(token.encode()).decode()
+        await build_package.task(body["package_id"], body["build_id"], token, body.get("idempotency_key"))
+    elif msg == MERGE_SCRATCH:
+        await merge_scratch.task(body["build_id"])
+    elif msg == EXPAND_BATCH:
+        await expand_batch.task(body["batch_type"], body["batch_id"], body.get("token"))
+    else:
+        logger.error("[*] Received unknown message")
+
+
+# message_type None drains the shared queue used before every message type got its own queue
+async def consume_messages(message_type: Optional[str], i: int, prefetch: int):
+    from distrobuild_scheduler import connection
+
+    worker_channel = await connection.channel()
+    await worker_channel.set_qos(prefetch_count=prefetch)
+
+    if message_type:
+        queue = await declare_queue(worker_channel, message_type)
+    else:
+        queue = await worker_channel.declare_queue(settings.routing_key, auto_delete=False)
 
-async def consume_messages(i: int):
-    from distrobuild_scheduler import channel
-
-    queue = await channel.declare_queue(settings.routing_key, auto_delete=False)
     async with queue.iterator() as queue_iter:
-        logger.info(f"[*] Waiting for messages (worker {i})")
+        logger.info(f"[*] Waiting for messages on {queue.name} (worker {i})")
         async for message in queue_iter:
             async with message.process():
                 body = json.loads(message.body.decode())
                 msg = body.get("message")
 
-                if msg == "import_package":
-                    await import_package.task(body["package_id"], body["import_id"], body["dependents"],
-                                              body["allow_stream_branches"])
-                elif msg == "build_package":
-                    token = body.get("token")
-                    if token:
-                        token = message_cipher.decrypt(token.encode()).decode()
-                    await build_package.task(body["package_id"], body["build_id"], token)
-                elif msg == "merge_scratch":
-                    await merge_scratch.task(body["build_id"])
-                else:
-                    logger.error("[*] Received unknown message")
+                if msg in busy_workers:
+                    busy_workers[msg] += 1
+                try:
+                    await handle_message(body)
+                finally:
+                    if msg in busy_workers:
+                        busy_workers[msg] -= 1
+
+
+async def report_queue_stats():
+    from distrobuild_scheduler import connection, redis
+
+    stats_channel = await connection.channel()
+    while True:
+        try:
+            stats = {}
+            for message_type in MESSAGE_TYPES:
+                queue = await stats_channel.declare_queue(queue_name(message_type), passive=True)
+                workers = worker_pools[message_type][0]
+                stats[message_type] = {
+                    "queue": queue.name,
+                    "depth": queue.declaration_result.message_count,
+                    "consumers": queue.declaration_result.consumer_count,
+                    "workers": workers,
+                    "busy_workers": busy_workers[message_type],
+                    "utilization": busy_workers[message_type] / workers if workers else 0,
+                }
+                logger.debug(f"[*] {message_type}: {stats[message_type]}")
+
+            await redis.set(QUEUE_STATS_KEY, json.dumps(stats), expire=settings.queue_stats_interval * 3)
+        except Exception as e:
+            logger.error(f"report_queue_stats: {e}")
+
+        await asyncio.sleep(settings.queue_stats_interval)
 
 
 def schedule_periodic_tasks():
+    # an unknown source fails here, before anything has been started
+    source = build_events.create_source(settings.build_event_source) if settings.build_event_source else None
+
     asyncio.create_task(periodic_tasks.check_build_status())
     asyncio.create_task(periodic_tasks.sign_unsigned_builds())
+    asyncio.create_task(report_queue_stats())
+    if source:
+        asyncio.create_task(build_events.listen_for_build_events(source))
 
 
 async def main(loop):
     try:
         await Tortoise.init(config=TORTOISE_ORM)
         await init_channel(loop)
+        await init_redis()
+        await mbs_client.open()
 
         if not settings.disable_sigul:
             await check_sigul_key()
 
         schedule_periodic_tasks()
 
-        tasks = [consume_messages(i) for i in range(0, settings.workers)]
+        tasks = [consume_messages(None, 0, 1)]
+        for message_type, (workers, prefetch) in worker_pools.items():
+            tasks += [consume_messages(message_type, i, prefetch) for i in range(0, workers)]
         await asyncio.wait(tasks)
     finally:
         from distrobuild_scheduler import connection
         logger.info("[*] Shutting down")
         await connection.close()
+        await close_redis()
+        await mbs_client.close()
+        koji_session.close()
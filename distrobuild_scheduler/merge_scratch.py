@@ -27,7 +27,7 @@ from distrobuild.session import koji_session
 @atomic()
 async def do(build: Build):
     if build.koji_id and build.scratch and not build.scratch_merged and build.status == BuildStatus.SUCCEEDED:
-        koji_session.mergeScratch(build.koji_id)
+        await koji_session.mergeScratch(build.koji_id)
         build.scratch_merged = True
         await build.save()
 
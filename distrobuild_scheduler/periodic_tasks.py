@@ -22,57 +22,152 @@ import asyncio
 import datetime
 import xmlrpc
 
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Union
+
 import koji
 from tortoise.transactions import atomic
 
 from distrobuild.common import tags
+from distrobuild.common.cache import TTLCache
 from distrobuild.models import Build, BuildStatus, Package, PackageModule, Repo
 from distrobuild.session import koji_session, mbs_client
 from distrobuild.settings import settings
 
 from distrobuild_scheduler import logger
-from distrobuild_scheduler.sigul import sign_koji_package
+from distrobuild_scheduler.signing import signing_pipeline, SigningException
+
+
+# (rpm id, sigkey) pairs known to be signed already
+signature_cache = TTLCache(settings.signature_cache_ttl, settings.signature_cache_size)
+
+
+@dataclass
+class CycleStats:
+    koji_calls: int = 0
+    koji_round_trips: int = 0
+    rpms_signed: int = 0
+    rpms_skipped: int = 0
+    rpms_failed: int = 0
+    # build id -> "succeeded", "failed" or "timed out"
+    build_outcomes: Dict[int, str] = field(default_factory=dict)
+
+    def log(self, name: str):
+        outcomes = list(self.build_outcomes.values())
+        logger.info(f"[*] {name}: {outcomes.count('succeeded')} builds succeeded, {outcomes.count('failed')} failed, "
+                    f"{outcomes.count('timed out')} timed out")
+
+        saved = self.koji_calls - self.koji_round_trips
+        logger.info(f"[*] {name}: {self.koji_calls} koji calls in {self.koji_round_trips} round trips "
+                    f"({saved} round trips saved)")
+        if self.rpms_signed or self.rpms_skipped or self.rpms_failed:
+            logger.info(f"[*] {name}: {self.rpms_signed} rpms signed, {self.rpms_skipped} skipped, "
+                        f"{self.rpms_failed} failed")
+
+
+async def koji_multicall(stats: CycleStats, method: str, calls: List[Union[tuple, dict]], **kwargs) -> list:
+    results = await koji_session.multicall(method, calls, **kwargs)
+    stats.koji_calls += len(calls)
+    stats.koji_round_trips += koji_session.multicall_round_trips(len(calls))
+    return results
+
+
+# Runs fn for every build, at most periodic_concurrency at a time. Builds that haven't
+# finished within periodic_cycle_deadline are cancelled and picked up again next cycle.
+# Cancelling only undoes database writes, anything already done in koji stays done.
+async def process_builds(name: str, builds: List[Build], stats: CycleStats, fn: Callable[[Build], Awaitable[None]]):
+    semaphore = asyncio.Semaphore(settings.periodic_concurrency)
+
+    async def process(build: Build):
+        async with semaphore:
+            try:
+                await fn(build)
+                stats.build_outcomes[build.id] = "succeeded"
+            except Exception as e:
+                logger.error(f"{name}: build {build.id}: {e}")
+                stats.build_outcomes[build.id] = "failed"
+
+    if len(builds) == 0:
+        return
+
+    tasks = [asyncio.create_task(process(build)) for build in builds]
+    _, pending = await asyncio.wait(tasks, timeout=settings.periodic_cycle_deadline)
+    for task in pending:
+        task.cancel()
+    # let the cancelled builds finish their cleanup (transaction, sigul processes) before returning
+    await asyncio.gather(*pending, return_exceptions=True)
+
+    for build in builds:
+        if build.id not in stats.build_outcomes:
+            logger.error(f"{name}: build {build.id} did not finish before the cycle deadline")
+            stats.build_outcomes[build.id] = "timed out"
+
 
+# warms the mbs client cache so the per build lookups don't hit mbs one by one
+async def prefetch_mbs_builds(builds: List[Build]):
+    mbs_ids = [build.mbs_id for build in builds if build.mbs_id]
+    try:
+        await mbs_client.get_builds(mbs_ids)
+    except Exception as e:
+        logger.error(f"prefetch_mbs_builds: {e}")
 
-async def sign_build_rpms(build_rpms):
-    for build_rpm in build_rpms:
-        rpm_sigs = koji_session.queryRPMSigs(build_rpm["id"])
-        for rpm_sig in rpm_sigs:
-            if rpm_sig["sigkey"] == settings.sigul_key_id:
-                continue
 
-        nvr_arch = "%s.%s" % (build_rpm["nvr"], build_rpm["arch"])
-        logger.debug(f"[*] signing NVR {nvr_arch}")
-        await sign_koji_package(nvr_arch)
-        koji_session.writeSignedRPM(nvr_arch, settings.sigul_key_id)
+async def sign_build_rpms(build_rpms, stats: CycleStats):
+    key_id = settings.sigul_key_id
 
+    unknown_rpms = [build_rpm for build_rpm in build_rpms if (build_rpm["id"], key_id) not in signature_cache]
+    stats.rpms_skipped += len(build_rpms) - len(unknown_rpms)
 
-def tag_if_not_tagged(build_history, nvr, tag):
+    all_rpm_sigs = await koji_multicall(stats, "queryRPMSigs", [(build_rpm["id"],) for build_rpm in unknown_rpms])
+    rpm_ids = {}
+    for build_rpm, rpm_sigs in zip(unknown_rpms, all_rpm_sigs):
+        if any(rpm_sig["sigkey"] == key_id for rpm_sig in rpm_sigs):
+            signature_cache.set((build_rpm["id"], key_id), True)
+            stats.rpms_skipped += 1
+            continue
+
+        rpm_ids["%s.%s" % (build_rpm["nvr"], build_rpm["arch"])] = build_rpm["id"]
+
+    result = await signing_pipeline().sign(list(rpm_ids.keys()), settings.sigul_key_name, key_id)
+    for nvr_arch in result.signed:
+        signature_cache.set((rpm_ids[nvr_arch], key_id), True)
+    stats.rpms_signed += len(result.signed)
+    stats.rpms_failed += len(result.failed)
+
+    if len(result.failed) > 0:
+        raise SigningException(f"{len(result.failed)} of {len(rpm_ids)} rpms failed to sign")
+
+
+async def tag_if_not_tagged(build_history, nvr, tag):
     if "tag_listing" in build_history:
         for t in build_history["tag_listing"]:
             if t["tag.name"] == tag:
                 return
 
-    koji_session.tagBuild(tag, nvr)
+    await koji_session.tagBuild(tag, nvr)
 
 
-async def sign_mbs_build(build: Build, mbs_build):
+async def sign_mbs_build(build: Build, mbs_build, stats: CycleStats):
     tasks = mbs_build.get("tasks")
     if not tasks:
         return
     rpms = tasks.get("rpms")
     if not rpms:
         return
+
+    nvrs = []
     for rpm_name in rpms.keys():
         if rpm_name == "module-build-macros":
             continue
         rpm = rpms[rpm_name]
         if rpm["state"] != 1:
             continue
+        nvrs.append((rpm["nvr"],))
 
-        build_rpms = koji_session.listBuildRPMs(rpm["nvr"])
-        if len(build_rpms) > 0:
-            await sign_build_rpms(build_rpms)
+    all_build_rpms = await koji_multicall(stats, "listBuildRPMs", nvrs)
+    build_rpms = [build_rpm for nvr_build_rpms in all_build_rpms for build_rpm in nvr_build_rpms]
+    if len(build_rpms) > 0:
+        await sign_build_rpms(build_rpms, stats)
 
     package_modules = await PackageModule.filter(
         module_parent_package_id=build.package.id).prefetch_related(
@@ -84,49 +179,53 @@ async def sign_mbs_build(build: Build, mbs_build):
 
     name = mbs_build["name"]
     name_devel = f"{name}-devel"
-    koji_session.packageListAdd(tags.module_compose(), name, "distrobuild")
-    koji_session.packageListAdd(tags.module_compose(), name_devel, "distrobuild")
+    await koji_session.packageListAdd(tags.module_compose(), name, "distrobuild")
+    await koji_session.packageListAdd(tags.module_compose(), name_devel, "distrobuild")
     koji_tag = mbs_build["koji_tag"]
     context = mbs_build["context"]
     nvr = koji_tag.replace("module-", "").replace(f"-{context}", f".{context}")
     nvr_devel = nvr.replace(name, name_devel)
-    koji_session.tagBuild(tags.module_compose(), nvr)
-    koji_session.tagBuild(tags.module_compose(), nvr_devel)
+    await koji_session.tagBuild(tags.module_compose(), nvr)
+    await koji_session.tagBuild(tags.module_compose(), nvr_devel)
 
     build.signed = True
     await build.save()
 
 
 @atomic()
-async def atomic_sign_unsigned_builds(build: Build):
+async def atomic_sign_unsigned_builds(build: Build, stats: CycleStats, build_tasks: Optional[list] = None):
     if build.koji_id:
-        koji_session.packageListAdd(tags.compose(), build.package.name, "distrobuild")
-
-        build_tasks = koji_session.listBuilds(taskID=build.koji_id)
-        for build_task in build_tasks:
-            build_history = koji_session.queryHistory(build=build_task["build_id"])
-            tag_if_not_tagged(build_history, build_task["nvr"], tags.compose())
-
-            build_rpms = koji_session.listBuildRPMs(build_task["build_id"])
-            await sign_build_rpms(build_rpms)
+        await koji_session.packageListAdd(tags.compose(), build.package.name, "distrobuild")
+
+        if build_tasks is None:
+            build_tasks = await koji_session.listBuilds(taskID=build.koji_id)
+        build_histories = await koji_multicall(stats, "queryHistory", [{"build": build_task["build_id"]}
+                                                                       for build_task in build_tasks])
+        all_build_rpms = await koji_multicall(stats, "listBuildRPMs", [(build_task["build_id"],)
+                                                                       for build_task in build_tasks])
+        for build_task, build_history, build_rpms in zip(build_tasks, build_histories, all_build_rpms):
+            await tag_if_not_tagged(build_history, build_task["nvr"], tags.compose())
+            await sign_build_rpms(build_rpms, stats)
 
         build.signed = True
         await build.save()
     elif build.mbs_id:
         mbs_build = await mbs_client.get_build(build.mbs_id)
-        await sign_mbs_build(build, mbs_build)
+        await sign_mbs_build(build, mbs_build, stats)
 
         siblings = mbs_build.get("siblings")
         if siblings:
+            sibling_builds = await mbs_client.get_builds(siblings)
             for sibling in siblings:
-                n_mbs_build = await mbs_client.get_build(sibling)
-                await sign_mbs_build(build, n_mbs_build)
+                n_mbs_build = sibling_builds.get(sibling) or await mbs_client.get_build(sibling)
+                await sign_mbs_build(build, n_mbs_build, stats)
 
 
 @atomic()
-async def atomic_check_build_status(build: Build):
+async def atomic_check_build_status(build: Build, task_info: Optional[dict] = None):
     if build.koji_id:
-        task_info = koji_session.getTaskInfo(build.koji_id, request=True)
+        if task_info is None:
+            task_info = await koji_session.getTaskInfo(build.koji_id, request=True)
         if task_info["state"] == koji.TASK_STATES["CLOSED"]:
             build.status = BuildStatus.SUCCEEDED
             await build.save()
@@ -139,7 +238,7 @@ async def atomic_check_build_status(build: Build):
             await build.save()
         elif task_info["state"] == koji.TASK_STATES["FAILED"]:
             try:
-                task_result = koji_session.getTaskResult(build.koji_id)
+                task_result = await koji_session.getTaskResult(build.koji_id)
                 logger.debug(task_result)
             except (koji.BuildError, xmlrpc.client.Fault):
                 build.status = BuildStatus.FAILED
@@ -166,16 +265,31 @@ async def check_build_status():
     while True:
         try:
             logger.debug("[*] Running periodic task: check_build_status")
+            stats = CycleStats()
 
             builds = await Build.filter(status=BuildStatus.BUILDING).all()
-            for build in builds:
-                try:
-                    await atomic_check_build_status(build)
-                except Exception as e:
-                    logger.error(f"check_build_status: {e}")
-
-            # run every 5 minutes
-            await asyncio.sleep(60 * 5)
+            koji_builds = [build for build in builds if build.koji_id]
+            try:
+                task_infos = await koji_multicall(stats, "getTaskInfo", [(build.koji_id,) for build in koji_builds],
+                                                  request=True)
+                task_info_by_build = dict(zip([build.id for build in koji_builds], task_infos))
+            except Exception as e:
+                # fall back to querying each build separately
+                logger.error(f"check_build_status multicall: {e}")
+                task_info_by_build = {}
+
+            await prefetch_mbs_builds(builds)
+
+            await process_builds("check_build_status", builds, stats,
+                                 lambda build: atomic_check_build_status(build, task_info_by_build.get(build.id)))
+
+            stats.log("check_build_status")
+
+            # with an event source, polling only reconciles missed events
+            if settings.build_event_source:
+                await asyncio.sleep(settings.build_status_reconcile_interval)
+            else:
+                await asyncio.sleep(settings.build_status_poll_interval)
         except Exception as e:
             logger.error(f"check_build_status wrapper: {e}")
 
@@ -185,14 +299,27 @@ async def sign_unsigned_builds():
         try:
             while True:
                 logger.debug("[*] Running periodic task: sign_unsigned_builds")
+                stats = CycleStats()
 
                 builds = await Build.filter(signed=False, status=BuildStatus.SUCCEEDED).prefetch_related(
                     "package").all()
-                for build in builds:
-                    try:
-                        await atomic_sign_unsigned_builds(build)
-                    except Exception as e:
-                        logger.error(f"sign_unsigned_builds: {e}")
+                koji_builds = [build for build in builds if build.koji_id]
+                try:
+                    all_build_tasks = await koji_multicall(stats, "listBuilds", [{"taskID": build.koji_id}
+                                                                                 for build in koji_builds])
+                    build_tasks_by_build = dict(zip([build.id for build in koji_builds], all_build_tasks))
+                except Exception as e:
+                    # fall back to querying each build separately
+                    logger.error(f"sign_unsigned_builds multicall: {e}")
+                    build_tasks_by_build = {}
+
+                await prefetch_mbs_builds(builds)
+
+                await process_builds("sign_unsigned_builds", builds, stats,
+                                     lambda build: atomic_sign_unsigned_builds(build, stats,
+                                                                               build_tasks_by_build.get(build.id)))
+
+                stats.log("sign_unsigned_builds")
 
                 # run every 5 minutes
                 await asyncio.sleep(60 * 5)
@@ -0,0 +1,128 @@
+#  Copyright (c) 2021 The Distrobuild Authors
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+import asyncio
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from distrobuild.session import koji_session
+from distrobuild.settings import settings
+from distrobuild_scheduler import logger
+from distrobuild_scheduler.sigul import sign_koji_package
+
+
+class SigningException(Exception):
+    pass
+
+
+# Spaces out acquisitions so that at most `rate` signatures per second are requested
+class RateLimiter:
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+
+        async with self.lock:
+            now = asyncio.get_event_loop().time()
+            wait = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+@dataclass
+class SigningResult:
+    signed: List[str] = field(default_factory=list)
+    failed: List[str] = field(default_factory=list)
+
+
+# Signs RPMs in two stages: sigul processes (bounded by sigul_concurrency and rate limited per key)
+# feed a bounded queue drained by writeSignedRPM workers. A full queue stops new sigul runs
+# until koji catches up.
+class SigningPipeline:
+    def __init__(self, sign_concurrency: int, write_concurrency: int, rate_limit: float, queue_size: int):
+        self.sign_semaphore = asyncio.Semaphore(sign_concurrency)
+        self.write_concurrency = write_concurrency
+        self.rate_limit = rate_limit
+        self.queue_size = queue_size
+        self.rate_limiters: Dict[str, RateLimiter] = {}
+
+    def rate_limiter(self, key_name: str) -> RateLimiter:
+        if key_name not in self.rate_limiters:
+            self.rate_limiters[key_name] = RateLimiter(self.rate_limit)
+        return self.rate_limiters[key_name]
+
+    async def sign(self, nvr_arches: List[str], key_name: str, key_id: str) -> SigningResult:
+        result = SigningResult()
+        write_queue = asyncio.Queue(maxsize=self.queue_size)
+
+        async def sign_one(nvr_arch: str):
+            async with self.sign_semaphore:
+                await self.rate_limiter(key_name).acquire()
+                logger.debug(f"[*] signing NVR {nvr_arch}")
+                try:
+                    await sign_koji_package(nvr_arch, key_name)
+                except Exception as e:
+                    logger.error(f"sign {nvr_arch}: {e}")
+                    result.failed.append(nvr_arch)
+                    return
+
+                # holding the sigul slot until there's room applies the backpressure
+                await write_queue.put(nvr_arch)
+
+        async def write_signed():
+            while True:
+                nvr_arch = await write_queue.get()
+                try:
+                    await koji_session.writeSignedRPM(nvr_arch, key_id)
+                    result.signed.append(nvr_arch)
+                except Exception as e:
+                    logger.error(f"writeSignedRPM {nvr_arch}: {e}")
+                    result.failed.append(nvr_arch)
+                finally:
+                    write_queue.task_done()
+
+        writers = [asyncio.create_task(write_signed()) for _ in range(self.write_concurrency)]
+        try:
+            await asyncio.gather(*[sign_one(nvr_arch) for nvr_arch in nvr_arches])
+            await write_queue.join()
+        finally:
+            for writer in writers:
+                writer.cancel()
+
+        return result
+
+
+_pipeline: Optional[SigningPipeline] = None
+
+
+# created lazily so the semaphore binds to the scheduler's running loop
+def signing_pipeline() -> SigningPipeline:
+    global _pipeline
+    if not _pipeline:
+        _pipeline = SigningPipeline(settings.sigul_concurrency, settings.sigul_write_concurrency,
+                                    settings.sigul_rate_limit, settings.sigul_queue_size)
+    return _pipeline
@@ -41,7 +41,14 @@ async def run_sigul(args: List[str]):
                                                 stdout=asyncio.subprocess.PIPE,
                                                 stderr=asyncio.subprocess.PIPE)
     proc.stdin.write(f"{settings.sigul_passphrase}\0".encode())
-    await proc.wait()
+    try:
+        await proc.wait()
+    except asyncio.CancelledError:
+        # don't leave sigul running when the caller gives up on it
+        if proc.returncode is None:
+            proc.terminate()
+        await proc.wait()
+        raise
 
     if proc.returncode != 0:
         err = (await proc.stderr.read()).decode()
@@ -58,12 +65,12 @@ async def check_sigul_key():
     await run_sigul(["get-public-key", settings.sigul_key_name])
 
 
-async def sign_koji_package(nvr_arch: str):
+async def sign_koji_package(nvr_arch: str, key_name: str = settings.sigul_key_name):
     await run_sigul([
         "sign-rpm",
         "--koji-only",
         "--store-in-koji",
         "--v3-signature",
-        settings.sigul_key_name,
+        key_name,
         nvr_arch
     ])
@@ -0,0 +1,50 @@
+/*
+ * Copyright (c) 2021 The Distrobuild Authors
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy
+ * of this software and associated documentation files (the "Software"), to deal
+ * in the Software without restriction, including without limitation the rights
+ * to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+ * copies of the Software, and to permit persons to whom the Software is
+ * furnished to do so, subject to the following conditions:
+ *
+ * The above copyright notice and this permission notice shall be included in all
+ * copies or substantial portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+ * IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+ * FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+ * AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+ * LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+ * OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+ * SOFTWARE.
+ */
+
+
+-- upgrade --
+alter table batch_imports
+    add column total int default 0 not null,
+    add column expanded int default 0 not null,
+    add column queued int default 0 not null,
+    add column failed int default 0 not null,
+    add column request jsonb;
+alter table batch_builds
+    add column total int default 0 not null,
+    add column expanded int default 0 not null,
+    add column queued int default 0 not null,
+    add column failed int default 0 not null,
+    add column request jsonb;
+
+-- downgrade --
+alter table batch_imports
+    drop column total,
+    drop column expanded,
+    drop column queued,
+    drop column failed,
+    drop column request;
+alter table batch_builds
+    drop column total,
+    drop column expanded,
+    drop column queued,
+    drop column failed,
+    drop column request;
@@ -0,0 +1,77 @@
+/*
+ * Copyright (c) 2021 The Distrobuild Authors
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy
+ * of this software and associated documentation files (the "Software"), to deal
+ * in the Software without restriction, including without limitation the rights
+ * to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+ * copies of the Software, and to permit persons to whom the Software is
+ * furnished to do so, subject to the following conditions:
+ *
+ * The above copyright notice and this permission notice shall be included in all
+ * copies or substantial portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+ * IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+ * FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+ * AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+ * LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+ * OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+ * SOFTWARE.
+ */
+
+
+-- upgrade --
+create extension if not exists pg_trgm;
+
+-- periodic tasks and build events
+create index if not exists builds_building_idx on builds (id) where status = 'BUILDING';
+create index if not exists builds_building_koji_id_idx on builds (koji_id) where status = 'BUILDING';
+create index if not exists builds_building_mbs_id_idx on builds (mbs_id) where status = 'BUILDING';
+create index if not exists builds_unsigned_idx on builds (created_at) where signed = false and status = 'SUCCEEDED';
+
+-- latest build/import of a package
+create index if not exists builds_package_id_status_created_at_idx
+    on builds (package_id, status, created_at desc) include (import_commit_id);
+create index if not exists imports_package_id_created_at_idx
+    on imports (package_id, created_at desc) include (module);
+create index if not exists import_commits_import__id_idx on import_commits (import__id);
+create index if not exists imports_parent_import_id_idx on imports (parent_import_id) where parent_import_id is not null;
+
+-- list endpoints
+create index if not exists builds_created_at_id_idx on builds (created_at desc, id desc);
+create index if not exists imports_created_at_id_idx on imports (created_at desc, id desc);
+create index if not exists packages_updated_at_name_id_idx on packages (updated_at, name, id);
+create index if not exists packages_name_idx on packages (name);
+-- name__icontains compiles to upper(cast(name as varchar)) like upper('%...%')
+create index if not exists packages_name_trgm_idx on packages using gin (upper(name::varchar) gin_trgm_ops);
+create index if not exists package_modules_module_parent_package_id_idx
+    on package_modules (module_parent_package_id) include (package_id);
+
+-- batches
+create index if not exists batch_import_packages_batch_import_id_idx
+    on batch_import_packages (batch_import_id) include (import_id);
+create index if not exists batch_import_packages_import_id_idx on batch_import_packages (import_id);
+create index if not exists batch_build_packages_batch_build_id_idx
+    on batch_build_packages (batch_build_id) include (build_id);
+create index if not exists batch_build_packages_build_id_idx on batch_build_packages (build_id);
+
+-- downgrade --
+drop index if exists builds_building_idx;
+drop index if exists builds_building_koji_id_idx;
+drop index if exists builds_building_mbs_id_idx;
+drop index if exists builds_unsigned_idx;
+drop index if exists builds_package_id_status_created_at_idx;
+drop index if exists imports_package_id_created_at_idx;
+drop index if exists import_commits_import__id_idx;
+drop index if exists imports_parent_import_id_idx;
+drop index if exists builds_created_at_id_idx;
+drop index if exists imports_created_at_id_idx;
+drop index if exists packages_updated_at_name_id_idx;
+drop index if exists packages_name_idx;
+drop index if exists packages_name_trgm_idx;
+drop index if exists package_modules_module_parent_package_id_idx;
+drop index if exists batch_import_packages_batch_import_id_idx;
+drop index if exists batch_import_packages_import_id_idx;
+drop index if exists batch_build_packages_batch_build_id_idx;
+drop index if exists batch_build_packages_build_id_idx;
@@ -0,0 +1,278 @@
+#  Copyright (c) 2021 The Distrobuild Authors
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+# Checks that the list, filter and search queries, exactly as the ORM generates them, use the indexes from
+# migrations/distrobuild/9_20261018140000_indexes.sql.
+#
+#   PYTHONPATH=. python3 scripts/explain_queries.py [--scale 1] [--analyze] [--search kernel] [--offset 5000]
+#
+# A representative dataset is seeded with generate_series and analyzed inside a transaction that is rolled
+# back afterwards, so the check can run against any database (on a small one the planner would just scan).
+# Every query has to use one of its expected indexes, the script exits with 1 otherwise.
+# --no-seed only prints the plans against the data that is there.
+
+import argparse
+import asyncio
+import json
+import sys
+
+from typing import List, Tuple, Optional, Set
+
+from tortoise import Tortoise
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.queryset import QuerySet
+from tortoise.transactions import in_transaction
+
+Tortoise.init_models(["distrobuild.models"], "distrobuild")
+
+from distrobuild.common.pagination import after
+from distrobuild.models import Build, BuildStatus, Import, Package, PackageModule
+from distrobuild.routes.packages import package_filters
+from distrobuild.serialize import build_list_values, import_list_values, import_commit_values
+from distrobuild.settings import TORTOISE_ORM
+
+SEEDED_TABLES = ("packages", "package_modules", "imports", "import_commits", "builds", "batch_imports",
+                 "batch_import_packages", "batch_builds", "batch_build_packages")
+SEED_USERNAME = "explain-queries-seed"
+
+PAGE_SIZE = 50
+
+BUILD_KEYS = [("created_at", True), ("id", True)]
+IMPORT_KEYS = [("created_at", True), ("id", True)]
+PACKAGE_KEYS = [("updated_at", False), ("name", False), ("id", False)]
+
+BUILDING_INDEXES = {"builds_building_idx", "builds_building_koji_id_idx", "builds_building_mbs_id_idx"}
+
+# (name, sql, indexes of which the plan has to use one, None if any plan will do)
+Check = Tuple[str, str, Optional[Set[str]]]
+
+
+class Rollback(Exception):
+    pass
+
+
+# scale 1 is 20k packages, 100k imports (one commit each) and 200k builds
+async def seed(connection: BaseDBAsyncClient, scale: int) -> Tuple[int, int]:
+    packages = 20000 * scale
+    imports = 100000 * scale
+
+    statements = [
+        # every 20th package is a module, updated_at is spread out like it is after a sync
+        f"""insert into packages (name, responsible_username, is_module, is_package, part_of_module, updated_at, repo,
+                                  last_import, last_build)
+            select 'seed-package-' || i, '{SEED_USERNAME}', i % 20 = 0, i % 20 <> 0, i % 7 = 0,
+                   now() - i * interval '1 minute', 'BASEOS',
+                   case when i % 3 = 0 then null else now() end, case when i % 4 = 0 then null else now() end
+            from generate_series(1, {packages}) i""",
+        f"""insert into package_modules (package_id, module_parent_package_id)
+            select s.ids[1 + (m.id * 10 + k) % array_length(s.ids, 1)], m.id
+            from packages m,
+                 generate_series(1, 10) k,
+                 (select array_agg(id) ids from packages where responsible_username = '{SEED_USERNAME}') s
+            where m.responsible_username = '{SEED_USERNAME}' and m.is_module""",
+        f"""insert into imports (created_at, status, module, version, executor_username, package_id)
+            select now() - i * interval '1 second', case when i % 10 = 0 then 'FAILED' else 'SUCCEEDED' end,
+                   false, 8, '{SEED_USERNAME}', s.ids[1 + i % array_length(s.ids, 1)]
+            from generate_series(1, {imports}) i,
+                 (select array_agg(id) ids from packages where responsible_username = '{SEED_USERNAME}') s""",
+        f"""insert into import_commits (commit, branch, import__id)
+            select md5(id::text), 'r8', id from imports where executor_username = '{SEED_USERNAME}'""",
+        # two builds per commit, a few are still building or not signed yet
+        f"""insert into builds (created_at, status, signed, koji_id, executor_username, point_release,
+                                import_commit_id, package_id)
+            select now() - (c.id * 2 + k) * interval '1 second',
+                   case when (c.id * 2 + k) % 1000 = 0 then 'BUILDING' else 'SUCCEEDED' end,
+                   (c.id * 2 + k) % 500 <> 0, c.id * 2 + k, '{SEED_USERNAME}', '8_4', c.id, i.package_id
+            from import_commits c
+                     join imports i on i.id = c.import__id,
+                 generate_series(0, 1) k
+            where i.executor_username = '{SEED_USERNAME}'""",
+    ]
+    for statement in statements:
+        await connection.execute_query(statement)
+
+    batch_import_id = (await connection.execute_query_dict(
+        "insert into batch_imports default values returning id"))[0]["id"]
+    await connection.execute_query(
+        f"""insert into batch_import_packages (import_id, batch_import_id)
+            select id, {batch_import_id} from imports where executor_username = '{SEED_USERNAME}' limit 5000""")
+    batch_build_id = (await connection.execute_query_dict(
+        "insert into batch_builds default values returning id"))[0]["id"]
+    await connection.execute_query(
+        f"""insert into batch_build_packages (build_id, batch_build_id)
+            select id, {batch_build_id} from builds where executor_username = '{SEED_USERNAME}' limit 5000""")
+
+    await connection.execute_query(f"analyze {', '.join(SEEDED_TABLES)}")
+    return batch_import_id, batch_build_id
+
+
+# same query as paginate_cursor builds for the page after the row at offset
+async def cursor_page(query: QuerySet, keys: List[Tuple[str, bool]], offset: int) -> QuerySet:
+    ordering = [f"-{key}" if descending else key for key, descending in keys]
+    rows = await query.order_by(*ordering).offset(offset).limit(1).values(*[key for key, _ in keys])
+    if len(rows) > 0:
+        query = query.filter(after(query, keys, [rows[0][key] for key, _ in keys]))
+    return query.order_by(*ordering).limit(PAGE_SIZE + 1)
+
+
+async def collect_queries(search: str, offset: int, batch_import_id: int, batch_build_id: int) -> List[Check]:
+    builds = Build.all().order_by("-created_at", "-id")
+    imports = Import.all().order_by("-created_at", "-id")
+    queries = [
+        ("builds: page", build_list_values(builds.offset(offset).limit(PAGE_SIZE)).sql(),
+         {"builds_created_at_id_idx"}),
+        ("builds: count", Build.all().count().sql(), None),
+        ("builds: cursor page", build_list_values(await cursor_page(Build.all(), BUILD_KEYS, offset)).sql(),
+         {"builds_created_at_id_idx"}),
+        ("imports: page", import_list_values(imports.offset(offset).limit(PAGE_SIZE)).sql(),
+         {"imports_created_at_id_idx"}),
+        ("imports: count", Import.all().count().sql(), None),
+        ("imports: cursor page", import_list_values(await cursor_page(Import.all(), IMPORT_KEYS, offset)).sql(),
+         {"imports_created_at_id_idx"}),
+    ]
+
+    import_ids = await imports.offset(offset).limit(PAGE_SIZE).values_list("id", flat=True)
+    queries.append(("imports: page commits", import_commit_values(import_ids or [0]).sql(),
+                    {"import_commits_import__id_idx"}))
+
+    # (name, filters, indexes for the count, None if it's a scan anyway)
+    package_queries = [
+        ("all", package_filters(), None),
+        (f"search {search!r}", package_filters(name=search), {"packages_name_trgm_idx"}),
+        ("modules only", package_filters(modules_only=True), None),
+        ("non modules only", package_filters(non_modules_only=True), None),
+        ("without builds", package_filters(no_builds_only=True, exclude_modular_candidates=True), None),
+        ("without imports", package_filters(no_imports_only=True, exclude_modular_candidates=True), None),
+        ("not part of modules", package_filters(exclude_part_of_modules=True), None),
+    ]
+    for name, filters, count_indexes in package_queries:
+        packages = Package.all().order_by("updated_at", "name").filter(**filters)
+        # a selective search may rather be answered from the trigram index and sorted
+        page_indexes = {"packages_updated_at_name_id_idx"} | (count_indexes or set())
+        queries += [
+            (f"packages {name}: page", packages.offset(offset).limit(PAGE_SIZE).sql(), page_indexes),
+            (f"packages {name}: count", packages.count().sql(), count_indexes),
+            (f"packages {name}: cursor page",
+             (await cursor_page(Package.filter(**filters), PACKAGE_KEYS, offset)).sql(), page_indexes),
+        ]
+
+    module = await Package.filter(is_module=True).order_by("-id").first()
+    if module:
+        queries.append(("package modules of a module",
+                        PackageModule.filter(module_parent_package_id=module.id).sql(),
+                        {"package_modules_module_parent_package_id_idx"}))
+
+    queries += [
+        ("batch builds: members", build_list_values(
+            Build.filter(batch_builds__id=batch_build_id).order_by("-created_at", "-id").limit(PAGE_SIZE)).sql(),
+         {"batch_build_packages_batch_build_id_idx"}),
+        ("batch imports: members", import_list_values(
+            Import.filter(batch_imports__id=batch_import_id).order_by("-created_at", "-id").limit(PAGE_SIZE)).sql(),
+         {"batch_import_packages_batch_import_id_idx"}),
+        ("periodic: building builds", Build.filter(status=BuildStatus.BUILDING).sql(), BUILDING_INDEXES),
+        ("periodic: unsigned builds", Build.filter(signed=False, status=BuildStatus.SUCCEEDED).sql(),
+         {"builds_unsigned_idx"}),
+        ("build events: koji task", Build.filter(koji_id=1000, status=BuildStatus.BUILDING).sql(),
+         {"builds_building_koji_id_idx"}),
+        ("build events: mbs build", Build.filter(mbs_id=1000, status=BuildStatus.BUILDING).sql(),
+         {"builds_building_mbs_id_idx"}),
+    ]
+
+    return queries
+
+
+def index_names(plan: dict) -> Set[str]:
+    names = {plan["Index Name"]} if "Index Name" in plan else set()
+    for child in plan.get("Plans", []):
+        names |= index_names(child)
+    return names
+
+
+# Prints every plan and returns the checks whose plan doesn't use any of the expected indexes
+async def explain(connection: BaseDBAsyncClient, checks: List[Check], analyze: bool) -> List[str]:
+    options = "analyze, buffers" if analyze else "costs"
+
+    failures = []
+    for name, sql, indexes in checks:
+        text = await connection.execute_query_dict(f"explain ({options}) {sql}")
+        plan = await connection.execute_query_dict(f"explain (format json) {sql}")
+        plan = plan[0]["QUERY PLAN"]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        used = index_names(plan[0]["Plan"])
+        ok = indexes is None or len(used & indexes) > 0
+        print(f"=== {name}: {'ok' if ok else 'FAILED'}")
+        print(sql)
+        print("\n".join(row["QUERY PLAN"] for row in text))
+        print()
+
+        if not ok:
+            failures.append(f"{name}: expected one of {', '.join(sorted(indexes))}, "
+                            f"used {', '.join(sorted(used)) or 'no index'}")
+
+    return failures
+
+
+async def main(args) -> int:
+    await Tortoise.init(config=TORTOISE_ORM)
+    connection = Tortoise.get_connection("default")
+
+    if args.no_seed:
+        checks = await collect_queries(args.search, args.offset, 0, 0)
+        await explain(connection, [(name, sql, None) for name, sql, _ in checks], args.analyze)
+        return 0
+
+    failures = []
+    try:
+        async with in_transaction() as transaction:
+            batch_import_id, batch_build_id = await seed(transaction, args.scale)
+            checks = await collect_queries(args.search, args.offset, batch_import_id, batch_build_id)
+            failures = await explain(transaction, checks, args.analyze)
+            raise Rollback()
+    except Rollback:
+        pass
+    finally:
+        # the seeded rows are gone, but the row estimates analyze stored in place are still theirs
+        await connection.execute_query(f"analyze {', '.join(SEEDED_TABLES)}")
+
+    if len(failures) > 0:
+        print("=== queries that don't use their index")
+        print("\n".join(failures))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that the list, filter and search queries use their indexes")
+    parser.add_argument("--scale", type=int, default=1, help="size of the seeded dataset")
+    parser.add_argument("--no-seed", action="store_true", help="only print the plans against the existing data")
+    parser.add_argument("--analyze", action="store_true", help="run the queries with EXPLAIN ANALYZE")
+    parser.add_argument("--search", default="kernel", help="package name to search for")
+    parser.add_argument("--offset", type=int, default=0, help="page offset (and cursor position) to explain")
+
+    loop = asyncio.new_event_loop()
+    status = 1
+    try:
+        status = loop.run_until_complete(main(parser.parse_args()))
+    finally:
+        loop.run_until_complete(Tortoise.close_connections())
+    loop.close()
+    sys.exit(status)
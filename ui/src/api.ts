@@ -75,15 +75,35 @@ export interface IBuild {
   scratch_merged: boolean;
 }
 
+export interface IBatchSummary {
+  id: string;
+  created_at: string;
+  total: number;
+  expanded: number;
+  queued: number;
+  failed: number;
+  members: number;
+  statuses: { [status: string]: number };
+  executor_username?: string;
+}
+
 export interface IBatchBuild {
   id: string;
   created_at: string;
+  total: number;
+  expanded: number;
+  queued: number;
+  failed: number;
   builds: IBuild[];
 }
 
 export interface IBatchImport {
   id: string;
   created_at: string;
+  total: number;
+  expanded: number;
+  queued: number;
+  failed: number;
   imports: IImport[];
 }
 
@@ -42,7 +42,7 @@ import {
   TextInput,
 } from 'carbon-components-react';
 
-import { IPaginated, Axios } from '../api';
+import { IPaginated, IBatchSummary, Axios } from '../api';
 import { changeQueryParam, getQueryParam, PageChangeEvent } from '../misc';
 import { Link } from 'react-router-dom';
 
@@ -246,6 +246,8 @@ export const BatchList = <T extends DataTableRow>(props: BatchListProps) => {
                     return;
                   }
 
+                  const summary = (pkg as unknown) as IBatchSummary;
+
                   return (
                     <TableRow key={i} {...getRowProps({ row })}>
                       {row.cells.map((cell) => (
@@ -259,37 +261,28 @@ export const BatchList = <T extends DataTableRow>(props: BatchListProps) => {
                           )}
                           {pkg && cell.info.header === 'package_count' && (
                             <TableCell key={`${cell.id}-count`}>
-                              {pkg[props.name].length}
+                              {summary.members}
                             </TableCell>
                           )}
                           {pkg && cell.info.header === 'failed' && (
                             <TableCell key={`${cell.id}-count`}>
-                              {
-                                pkg[props.name].filter(
-                                  (x) =>
-                                    x.status === 'FAILED' ||
-                                    x.status === 'CANCELLED'
-                                ).length
-                              }
+                              {(summary.statuses['FAILED'] || 0) +
+                                (summary.statuses['CANCELLED'] || 0)}
                             </TableCell>
                           )}
                           {pkg && cell.info.header === 'succeeded' && (
                             <TableCell key={`${cell.id}-succeeded`}>
-                              {
-                                pkg[props.name].filter(
-                                  (x) => x.status === 'SUCCEEDED'
-                                ).length
-                              }
+                              {summary.statuses['SUCCEEDED'] || 0}
                             </TableCell>
                           )}
                           {pkg && cell.info.header === 'executor_username' && (
                             <TableCell key={`${cell.id}-succeeded`}>
-                              {pkg[props.name].length > 0 ? (
+                              {summary.executor_username ? (
                                 <a
                                   target="_blank"
                                   href={`${window.SETTINGS.gitlabUrl}/${cell.value}`}
                                 >
-                                  {pkg[props.name][0]['executor_username']}
+                                  {summary.executor_username}
                                 </a>
                               ) : (
                                 <span>System</span>
@@ -0,0 +1,63 @@
+/*
+ * Copyright (c) 2021 The Distrobuild Authors
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy
+ * of this software and associated documentation files (the "Software"), to deal
+ * in the Software without restriction, including without limitation the rights
+ * to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+ * copies of the Software, and to permit persons to whom the Software is
+ * furnished to do so, subject to the following conditions:
+ *
+ * The above copyright notice and this permission notice shall be included in all
+ * copies or substantial portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+ * IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+ * FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+ * AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+ * LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+ * OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+ * SOFTWARE.
+ */
+
+import React from 'react';
+import { useParams } from 'react-router-dom';
+
+export interface ImportLogsParams {
+  id: string;
+}
+
+export const ImportLogs = () => {
+  const params = useParams<ImportLogsParams>();
+  const [log, setLog] = React.useState('');
+  const [done, setDone] = React.useState(false);
+  const [error, setError] = React.useState(false);
+
+  React.useEffect(() => {
+    // the server only sends lines we haven't seen, reconnects resume from the last event id
+    const source = new EventSource(
+      `/api/imports/${params.id}/logs?follow=true`
+    );
+    source.onmessage = (e) => setLog((log) => log + e.data + '\n');
+    source.addEventListener('end', () => {
+      setDone(true);
+      source.close();
+    });
+    source.onerror = () => {
+      if (source.readyState === EventSource.CLOSED) {
+        setError(true);
+      }
+    };
+
+    return () => source.close();
+  }, [params.id]);
+
+  return (
+    <div className="p-8 space-y-4">
+      <h1>Import {params.id}</h1>
+      {error && <p>Import not started or log has expired</p>}
+      <pre className="whitespace-pre-wrap text-sm">{log}</pre>
+      {!done && !error && <p>Following log...</p>}
+    </div>
+  );
+};
@@ -85,9 +85,7 @@ export const ImportsTable = (props: ImportsTableProps) => {
                   </a>
                 </TableCell>
                 <TableCell className="space-x-4">
-                  <a href={`/api/imports/${item.id}/logs`} target="_blank">
-                    Logs
-                  </a>
+                  <Link to={`/imports/${item.id}/logs`}>Logs</Link>
                   {commitsToLinks(item.module, item.package, item.commits)}
                 </TableCell>
               </TableRow>
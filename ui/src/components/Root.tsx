@@ -43,6 +43,7 @@ import { BuildBatchShow } from './BuildBatchShow';
 import { ImportBatchShow } from './ImportBatchShow';
 import { BuildsList } from './BuildsList';
 import { ImportsList } from './ImportsList';
+import { ImportLogs } from './ImportLogs';
 
 export const Root = () => {
   return (
@@ -92,6 +93,7 @@ export const Root = () => {
           <Route path="/packages/:id" component={ShowPackage} />
           <Route path="/packages" component={Packages} />
           <Route path="/builds" component={BuildsList} />
+          <Route path="/imports/:id/logs" component={ImportLogs} />
           <Route path="/imports" component={ImportsList} />
           <Route path="/batches/builds/:id" component={BuildBatchShow} />
           <Route path="/batches/builds" component={BuildBatches} />